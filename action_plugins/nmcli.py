@@ -0,0 +1,135 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# (c) 2015, Chris Long <alcamie@gmail.com> <chlong@redhat.com>
+#
+# This file is a module for Ansible that interacts with Network Manager
+#
+# Ansible is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Ansible is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.    See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Ansible.    If not, see <http://www.gnu.org/licenses/>.
+
+# Action plugin for the nmcli module.  A looped nmcli task (with_items or
+# loop) normally ships and runs the module once per item per host.  On the
+# first item this plugin templates the task's arguments for every item and
+# runs the module once with all of them in its 'connections' option; each
+# item then gets its own entry of that run's results back.  Tasks it can't
+# batch safely (no loop, per item 'when' or 'until', a loop pause) run the
+# usual way, and so do all items if the batched run fails as a whole, e.g.
+# against an older module without 'connections'.  An async task is never
+# batched; it is wrapped for async like any other module.
+
+import json
+
+from ansible.parsing.mod_args import ModuleArgsParser
+from ansible.plugins.action import ActionBase
+
+# (task, host) -> {item args: [results]}, or None once batching gave up.
+# A host's loop runs in one worker process, item after item.
+BATCHES={}
+
+
+def args_key(args):
+    return json.dumps(args, sort_keys=True, default=str)
+
+
+class ActionModule(ActionBase):
+
+    def run(self, tmp=None, task_vars=None):
+        if task_vars is None:
+            task_vars={}
+        self._supports_async=True
+        result=super(ActionModule, self).run(tmp, task_vars)
+
+        # as the normal action does, for an 'async:' task
+        wrap_async=getattr(self._task, 'async_val', None) and not getattr(self._connection, 'has_native_async', False)
+        key=(self._task._uuid, task_vars.get('inventory_hostname'))
+        if key not in BATCHES:
+            BATCHES[key]=not wrap_async and self.run_batch(task_vars) or None
+        batch=BATCHES[key]
+        results=batch is not None and batch.get(args_key(self._task.args))
+        if results:
+            result.update(results.pop(0))
+            return result
+        result.update(self._execute_module(module_name='nmcli', module_args=self._task.args, task_vars=task_vars, wrap_async=wrap_async))
+        return result
+
+    def loop_items(self, task_vars):
+        # every item of the task's loop, or None when it should not be batched
+        task=self._task
+        if task.when or getattr(task, 'until', None):
+            return None
+        loop_control=getattr(task, 'loop_control', None)
+        if loop_control is not None and getattr(loop_control, 'pause', 0):
+            return None
+        loop=task_vars.get('ansible_loop')
+        if loop and 'allitems' in loop:
+            return loop['allitems']
+        if getattr(task, 'loop_with', None)=='items':
+            # Ansible 2.5 and later: with_items terms
+            terms=task.loop
+        elif getattr(task, 'loop_with', None) is None and getattr(task, 'loop_args', None) is None and task.loop is not None:
+            # Ansible 2.5 and later: loop
+            return self._templar.template(task.loop)
+        elif task.loop=='items':
+            # before 2.5: with_items terms
+            terms=task.loop_args
+        else:
+            return None
+        items=[]
+        for term in self._templar.template(terms):
+            # with_items flattens one level
+            if isinstance(term, list):
+                items.extend(term)
+            else:
+                items.append(term)
+        return items
+
+    def item_args(self, items, task_vars):
+        # the module arguments for each item, templated the way the task
+        # executor templates them for that item
+        loop_control=getattr(self._task, 'loop_control', None)
+        loop_var=getattr(loop_control, 'loop_var', None) or 'item'
+        index_var=getattr(loop_control, 'index_var', None)
+        raw_args=ModuleArgsParser(self._task._ds).parse()[1]
+        saved=self._templar._available_variables
+        try:
+            args=[]
+            for index, item in enumerate(items):
+                item_vars=dict(task_vars)
+                item_vars[loop_var]=item
+                if index_var:
+                    item_vars[index_var]=index
+                self._templar.set_available_variables(item_vars)
+                item_args=self._templar.template(raw_args)
+                # as in post_validate(), omitted arguments are left out
+                args.append(dict((k, v) for k, v in item_args.items() if v!=task_vars.get('omit')))
+        finally:
+            self._templar.set_available_variables(saved)
+        return args
+
+    def run_batch(self, task_vars):
+        try:
+            items=self.loop_items(task_vars)
+        except Exception:
+            items=None
+        if not items or len(items) < 2:
+            return None
+        args=self.item_args(items, task_vars)
+        response=self._execute_module(module_name='nmcli', module_args=dict(connections=args), task_vars=task_vars)
+        # a run with failed items still has a result for each of them
+        if len(response.get('results', []))!=len(args):
+            return None
+        batch={}
+        for item, result in zip(args, response['results']):
+            batch.setdefault(args_key(item), []).append(result)
+        return batch
@@ -0,0 +1,117 @@
+# (c) 2015, Chris Long <alcamie@gmail.com> <chlong@redhat.com>
+#
+# This file is a module for Ansible that interacts with Network Manager
+#
+# Ansible is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Ansible is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.    See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Ansible.    If not, see <http://www.gnu.org/licenses/>.
+
+# Callback plugin collecting what every nmcli task reports about its run
+# (timing, dbus_calls, nmcli_calls, profile_count) across all hosts, and
+# summing it up at the end of the playbook: p50/p95/max of the run and
+# enumeration times, the slowest hosts and the hosts with the most
+# profiles.  Enable it with callback_whitelist = nmcli_timing in
+# ansible.cfg.  NMCLI_TIMING_JSON=<path> also writes every sample and the
+# summary as JSON, and NMCLI_TIMING_TOP sets how many hosts are listed (5).
+
+import json
+import os
+
+from ansible.plugins.callback import CallbackBase
+
+
+def percentile(values, percent):
+    # nearest rank
+    if not values:
+        return None
+    values=sorted(values)
+    return values[max(int(round(percent / 100.0 * len(values))) - 1, 0)]
+
+
+def spread(values):
+    return dict(p50=percentile(values, 50), p95=percentile(values, 95), max=max(values) if values else None)
+
+
+class CallbackModule(CallbackBase):
+    CALLBACK_VERSION=2.0
+    CALLBACK_TYPE='aggregate'
+    CALLBACK_NAME='nmcli_timing'
+    CALLBACK_NEEDS_WHITELIST=True
+
+    def __init__(self, *args, **kwargs):
+        super(CallbackModule, self).__init__(*args, **kwargs)
+        self.samples=[]
+        self.top=int(os.environ.get('NMCLI_TIMING_TOP', 5))
+        self.json_path=os.environ.get('NMCLI_TIMING_JSON')
+
+    def record(self, result):
+        if result._task.action!='nmcli':
+            return
+        # a loop, batched by the nmcli action plugin or not, reports per item
+        for item in result._result.get('results', [result._result]):
+            if not isinstance(item, dict) or 'timing' not in item:
+                continue
+            self.samples.append(dict(host=result._host.get_name(),
+                                     task=result._task.get_name(),
+                                     cname=item.get('cname'),
+                                     total=item['timing'].get('total'),
+                                     read=item['timing'].get('read'),
+                                     dbus_calls=item.get('dbus_calls'),
+                                     nmcli_calls=item.get('nmcli_calls'),
+                                     profile_count=item.get('profile_count'),
+                                     failed=bool(item.get('failed'))))
+
+    def v2_runner_on_ok(self, result):
+        self.record(result)
+
+    def v2_runner_on_failed(self, result, ignore_errors=False):
+        self.record(result)
+
+    def summary(self):
+        hosts={}
+        for sample in self.samples:
+            host=hosts.setdefault(sample['host'], dict(host=sample['host'], runs=0, total=0.0, dbus_calls=0, nmcli_calls=0, profile_count=None))
+            host['runs']+=1
+            host['total']+=sample['total'] or 0
+            host['dbus_calls']+=sample['dbus_calls'] or 0
+            host['nmcli_calls']+=sample['nmcli_calls'] or 0
+            if sample['profile_count'] is not None:
+                host['profile_count']=max(host['profile_count'] or 0, sample['profile_count'])
+        return dict(runs=len(self.samples),
+                    hosts=len(hosts),
+                    total=spread([sample['total'] for sample in self.samples if sample['total'] is not None]),
+                    read=spread([sample['read'] for sample in self.samples if sample['read'] is not None]),
+                    dbus_calls=sum([host['dbus_calls'] for host in hosts.values()]),
+                    nmcli_calls=sum([host['nmcli_calls'] for host in hosts.values()]),
+                    slowest_hosts=sorted(hosts.values(), key=lambda host: host['total'], reverse=True)[:self.top],
+                    most_profiles=sorted([host for host in hosts.values() if host['profile_count'] is not None],
+                                         key=lambda host: host['profile_count'], reverse=True)[:self.top])
+
+    def v2_playbook_on_stats(self, stats):
+        if not self.samples:
+            return
+        summary=self.summary()
+        self._display.banner('NMCLI TIMING')
+        self._display.display('%d nmcli runs on %d hosts, %d D-Bus calls, %d nmcli calls' % (summary['runs'], summary['hosts'], summary['dbus_calls'], summary['nmcli_calls']))
+        for name in ('total', 'read'):
+            values=summary[name]
+            if values['max'] is not None:
+                self._display.display('%-6s p50 %8.3fs  p95 %8.3fs  max %8.3fs' % (name, values['p50'], values['p95'], values['max']))
+        self._display.display('slowest hosts:')
+        for host in summary['slowest_hosts']:
+            self._display.display('    %-40s %8.3fs in %d runs, %d D-Bus calls' % (host['host'], host['total'], host['runs'], host['dbus_calls']))
+        self._display.display('most profiles:')
+        for host in summary['most_profiles']:
+            self._display.display('    %-40s %8d' % (host['host'], host['profile_count']))
+        if self.json_path:
+            with open(self.json_path, 'w') as report:
+                json.dump(dict(summary=summary, samples=self.samples), report, indent=2, sort_keys=True)
@@ -25,6 +25,8 @@ module: nmcli
 author: Chris Long
 short_description: Manage Networking
 requirements: [ nmcli, dbus ]
+notes:
+    - dbus-python and PyGObject are not needed with render_root.
 description:
     - Manage the network devices. Create, modify, and manage, ethernet, teams, bonds, vlans etc.
 options:
@@ -34,6 +36,7 @@ options:
         choices: [ present, absent ]
     description:
         - Whether the device should exist or not, taking action if the state is different from what is stated.
+        - Not required with connections, as long as each of them has a state.
     enabled:
         required: False
         default: "yes"
@@ -41,6 +44,12 @@ options:
         description:
             - Whether the service should start on boot. B(At least one of state and enabled are required.)
             - Whether the connection profile can be automatically activated ( default: yes)
+    autoconnect:
+        required: False
+        default: None
+        choices: [ "yes", "no" ]
+        description:
+            - The older name of enabled, used when enabled is not given.
     action:
         required: False
         default: None
@@ -50,6 +59,7 @@ options:
             - Set to 'modify' if you want to modify a connection. Modify one or more properties in the connection profile.
             - Set to 'delete' if you want to delete a connection. Delete a configured connection. The connection to be deleted is identified by its name 'cfname'.
             - Set to 'show' if you want to show a connection. Will show all devices unless 'cfname' is set.
+            - 'show' is read only; the full settings are only decoded and returned for the connection named by 'cname'.
             - Set to 'up' if you want to bring a connection up. Requires 'cfname' to be set.
             - Set to 'down' if you want to bring a connection down. Requires 'cfname' to be set.
     cname:
@@ -67,9 +77,10 @@ options:
             - The ifname argument is mandatory for all connection types except bond, team, bridge and vlan.
     type:
         required: False
-        choices: [ ethernet, team, team-slave, bond, bond-slave, bridge, vlan ]
+        choices: [ ethernet, team, team-slave, bond, bond-slave, bridge, vlan, dummy, veth ]
         description:
             - This is the type of device or network connection that you wish to create.
+            - dummy (NetworkManager 1.8 and later) and veth (1.30 and later) need no hardware; with master and slave_type they are ports of a bond, team or bridge.
     mode:
         required: False
         choices: [ "balance-rr", "active-backup", "balance-xor", "broadcast", "802.3ad", "balance-tlb", "balance-alb" ]
@@ -81,6 +92,17 @@ options:
         default: None
         description:
             - master <master (ifname, or connection UUID or cname) of bridge, team, bond master connection profile.
+    slave_type:
+        required: False
+        choices: [ bond, team, bridge ]
+        default: None
+        description:
+            - The kind of master a dummy or veth port with master is enslaved to. Required with master for those types.
+    veth_peer:
+        required: False
+        default: None
+        description:
+            - The interface name of the other end of a veth pair. Required to create a veth connection.
     ip4:
         required: False
         default: None
@@ -91,7 +113,8 @@ options:
     dns4:
         required: False
         default: None
-        description: A list of upto 3 dns servers, ipv4 format e.g. To add two IPv4 DNS server addresses: ['"8.8.8.8 8.8.4.4"']
+        description:
+            - A list of DNS servers, in the order they are tried, e.g. ['8.8.8.8', '8.8.4.4']. The older single string of servers separated by spaces, ['"8.8.8.8 8.8.4.4"'], still works.
     ip6:
         required: False
         default: None
@@ -103,18 +126,159 @@ options:
         description: The IPv6 gateway for this interface using this format ie: "2001:db8::1"
     dns6:
         required: False
-        description: A list of upto 3 dns servers, ipv6 format e.g. To add two IPv6 DNS server addresses: ['"2001:4860:4860::8888 2001:4860:4860::8844"']
+        description:
+            - A list of IPv6 DNS servers, in the order they are tried, e.g. ['2001:4860:4860::8888', '2001:4860:4860::8844'].
+    dns4_search:
+        required: False
+        default: None
+        description:
+            - A list of search domains (ipv4.dns-search). Their order doesn't count when comparing with the profile.
+    dns6_search:
+        required: False
+        default: None
+        description:
+            - The same for ipv6.dns-search.
+    dns4_options:
+        required: False
+        default: None
+        description:
+            - A list of resolv.conf options (ipv4.dns-options), e.g. ['timeout:1', 'attempts:2', 'rotate', 'single-request-reopen'], so that a dead first server costs a second instead of five. Their order doesn't count when comparing with the profile. NetworkManager 1.2 and later.
+    dns6_options:
+        required: False
+        default: None
+        description:
+            - The same for ipv6.dns-options.
+    dns4_priority:
+        required: False
+        default: None
+        description:
+            - ipv4.dns-priority: servers and domains of connections with a lower value come first in resolv.conf, and a negative value leaves out those of connections with a higher one (NetworkManager defaults: 50 for VPNs, 100 otherwise). NetworkManager 1.4 and later.
+    dns6_priority:
+        required: False
+        default: None
+        description:
+            - The same for ipv6.dns-priority.
     mtu:
         required: False
         default: None
         description:
             - The connection MTU, e.g. 9000. This can't be applied when creating the interface and is done once the interface has been created. (NetworkManager default: 1500)
             - Can be used when modifying Team, VLAN, Ethernet (Future plans to implement wifi, pppoe, infiniband)
+    ethtool_features:
+        required: False
+        default: None
+        description:
+            - NIC offload features to keep set on an Ethernet, team-slave or bond-slave connection, as a dict of feature to on/off (or yes/no), e.g. {tso: off, gro: on, lro: off}. Keys may be given with or without the 'feature-' prefix of NetworkManager's ethtool.feature-* properties. 'ignore' leaves a feature to the driver.
+            - NetworkManager applies them on every activation, so they survive link bounces, and they are compared and written along with the other properties. Needs NetworkManager 1.14 or later.
+    ethtool_ring:
+        required: False
+        default: None
+        description:
+            - RX/TX ring sizes for the same connections, e.g. {rx: 4096, tx: 4096}, set as ethtool.ring-*. Needs NetworkManager 1.26 or later.
+    ethtool_coalesce:
+        required: False
+        default: None
+        description:
+            - Interrupt coalescing parameters for the same connections, e.g. {rx-usecs: 50, adaptive-rx: on}, set as ethtool.coalesce-*. Needs NetworkManager 1.26 or later.
+    tc_qdiscs:
+        required: False
+        default: None
+        description:
+            - Queueing disciplines NetworkManager sets up on the device whenever the connection comes up, in nmcli's tc.qdiscs syntax, e.g. [ "root fq_codel" ] or [ "root handle 1: mq", "parent 1:1 fq" ]. An empty list removes them. Can be used with every type. Needs NetworkManager 1.12 or later.
+            - They are compared with NetworkManager's by content, whatever the spelling of handles.
+    tc_tfilters:
+        required: False
+        default: None
+        description:
+            - Traffic filters in nmcli's tc.tfilters syntax, e.g. [ "parent ffff: matchall action simple sdata Hello" ], handled like tc_qdiscs.
+    route_metric4:
+        required: False
+        default: None
+        description:
+            - The metric of the connection's IPv4 routes, default route included; -1 leaves it to NetworkManager. Used with every type except the ports of a master (team-slave, bond-slave, and dummy or veth with master).
+    route_metric6:
+        required: False
+        default: None
+        description:
+            - The same for IPv6 routes.
+    autoconnect_slaves:
+        required: False
+        default: None
+        description:
+            - Whether activating a master also activates its slaves (connection.autoconnect-slaves), so that they come up together instead of in NetworkManager's own order. Unset, NetworkManager's default applies.
+    autoconnect_priority:
+        required: False
+        default: None
+        description:
+            - connection.autoconnect-priority, -999 to 999. Profiles with a higher priority are activated first when several could be (NetworkManager default: 0).
+    autoconnect_retries:
+        required: False
+        default: None
+        description:
+            - connection.autoconnect-retries, how often autoconnecting the profile is tried before giving up. 0 is for ever, -1 NetworkManager's global default.
+    wait_device_timeout:
+        required: False
+        default: None
+        description:
+            - connection.wait-device-timeout in milliseconds, how long NetworkManager waits at startup for the profile's device to appear (NetworkManager 1.20 and later, -1 is its default).
+    method4:
+        required: False
+        default: None
+        choices: [ auto, manual, link-local, shared, disabled ]
+        description:
+            - ipv4.method. Left unset, a connection with ip4 is 'manual' and one without is 'auto'.
+    method6:
+        required: False
+        default: None
+        choices: [ auto, dhcp, manual, link-local, shared, ignore, disabled ]
+        description:
+            - ipv6.method. Left unset, a connection with ip6 is 'manual' and one without is 'auto'. 'disabled' needs NetworkManager 1.20 or later; 'ignore' leaves IPv6 to the kernel.
+    dhcp_timeout4:
+        required: False
+        default: None
+        description:
+            - ipv4.dhcp-timeout, how many seconds to wait for a DHCP lease before the IPv4 configuration fails (NetworkManager default: 45).
+    dhcp_timeout6:
+        required: False
+        default: None
+        description:
+            - The same for DHCPv6 (ipv6.dhcp-timeout, NetworkManager 1.12 and later).
+    may_fail4:
+        required: False
+        default: None
+        description:
+            - ipv4.may-fail. With no, the connection is only activated once IPv4 is configured; with yes (NetworkManager's default) it may be activated with IPv6 alone.
+    may_fail6:
+        required: False
+        default: None
+        description:
+            - The same for IPv6 (ipv6.may-fail).
+    dad_timeout4:
+        required: False
+        default: None
+        description:
+            - ipv4.dad-timeout in milliseconds, how long to probe for IPv4 address conflicts before the addresses are configured. 0 skips the probe, -1 is NetworkManager's default. NetworkManager has no such setting for IPv6, where duplicate address detection is up to the kernel.
+    addr_gen_mode6:
+        required: False
+        default: None
+        choices: [ eui64, stable-privacy, default-or-eui64, default ]
+        description:
+            - ipv6.addr-gen-mode, how the IPv6 link-local and SLAAC addresses are generated. default-or-eui64 and default need NetworkManager 1.40 or later.
+    required_timeout4:
+        required: False
+        default: None
+        description:
+            - ipv4.required-timeout in milliseconds, how long activation waits for IPv4 even with may_fail4 set (NetworkManager 1.34 and later, -1 is its default).
+    required_timeout6:
+        required: False
+        default: None
+        description:
+            - The same for IPv6 (ipv6.required-timeout).
     primary:
         required: False
         default: None
         description:
-            - This is only used with bond and is the primary interface name (for "active-backup" mode), this is the usually the 'ifname'
+            - This is only used with bond and is the primary interface name (for "active-backup", "balance-tlb" and "balance-alb" mode), this is the usually the 'ifname'
     miimon:
         required: False
         default: None
@@ -140,6 +304,60 @@ options:
         default: None
         description:
             - This is only used with bond - ARP IP target
+    xmit_hash_policy:
+        required: False
+        default: None
+        choices: [ "layer2", "layer2+3", "layer3+4", "encap2+3", "encap3+4" ]
+        description:
+            - This is only used with bond in balance-xor, 802.3ad or balance-tlb mode - how slaves are picked for outgoing traffic. layer3+4 spreads flows between the same two hosts over all slaves.
+    lacp_rate:
+        required: False
+        default: None
+        choices: [ "slow", "fast" ]
+        description:
+            - This is only used with bond in 802.3ad mode - how often the link partner is asked for LACPDUs, every 30 seconds (slow) or every second (fast)
+    ad_select:
+        required: False
+        default: None
+        choices: [ "stable", "bandwidth", "count" ]
+        description:
+            - This is only used with bond in 802.3ad mode - how the active aggregator is chosen
+    all_slaves_active:
+        required: False
+        default: None
+        choices: [ "yes", "no" ]
+        description:
+            - This is only used with bond - whether frames received on inactive slaves are delivered rather than dropped
+            - Bond options are compared with what NetworkManager has and changed in place, and an option given for a mode it doesn't apply to is refused
+    runner:
+        required: False
+        default: None
+        choices: [ "roundrobin", "activebackup", "loadbalance", "broadcast", "random", "lacp" ]
+        description:
+            - This is only used with team - the teamd runner (teamd default: roundrobin)
+            - The team options are rendered as one team.config JSON document and compared with NetworkManager's by content, so key order and the defaults teamd fills in don't count as changes
+            - On an existing team the options given are merged into its team.config, and runner_tx_hash and runner_tx_balancer_interval are checked against its runner when runner is left out
+    runner_tx_hash:
+        required: False
+        default: None
+        description:
+            - This is only used with team with the loadbalance or lacp runner - the packet fields hashed to pick a port, e.g. [ eth, ipv4, ipv6, l4 ]
+    runner_tx_balancer_interval:
+        required: False
+        default: None
+        description:
+            - This is only used with team with the loadbalance or lacp runner - enables the basic tx balancer, rebalancing every this many tenths of a second
+    link_watch:
+        required: False
+        default: None
+        choices: [ "ethtool", "arp_ping", "nsna_ping" ]
+        description:
+            - This is only used with team - how port link state is watched (teamd default: ethtool)
+    team_port_priority:
+        required: False
+        default: None
+        description:
+            - This is only used with team-slave - the port's priority in team-port.config; the higher, the more it is preferred by activebackup and lacp
     stp:
         required: False
         default: None
@@ -215,6 +433,107 @@ options:
         default: None
         description:
             - This is only used with VLAN - VLAN egress priority mapping
+    dbus_inflight:
+        required: False
+        default: 32
+        description:
+            - The number of D-Bus GetSettings requests kept in flight at once while enumerating connection profiles.
+            - Raising it shortens enumeration on hosts with thousands of profiles, up to NetworkManager's own throughput.
+    read_backend:
+        required: False
+        default: auto
+        choices: [ auto, dbus, nmcli, files ]
+        description:
+            - Where connection profiles are read from. 'dbus' asks NetworkManager over D-Bus, and needs python-dbus and PyGObject.
+            - 'nmcli' lists the profiles with two terse 'nmcli con show' calls, the second for the connection setting of all of them, and reads a profile's settings with another nmcli call only when they are needed, so it works on hosts without python-dbus.
+            - 'auto' is 'dbus' where python-dbus is installed and 'nmcli' where it is not.
+            - 'files' parses the keyfile (/etc/NetworkManager/system-connections) and ifcfg (/etc/sysconfig/network-scripts) profiles directly, so existence checks and check mode never wake NetworkManager.
+            - With 'files', NetworkManager is still asked before anything is written, using the backend 'auto' picks.
+    write_method:
+        required: False
+        default: mod
+        choices: [ mod, edit ]
+        description:
+            - How profiles are written. 'mod' runs 'nmcli con add' and 'nmcli con mod' with the properties as arguments.
+            - 'edit' feeds 'set' and 'save' commands to an 'nmcli con edit' session on stdin, so a new profile is created with all of its properties by a single nmcli, even where NetworkManager is older than 1.6 and 'con add' takes no properties. Errors the session reports fail the task.
+    files_root:
+        required: False
+        default: /
+        description:
+            - The root directory the 'files' read backend looks for the profile directories under.
+    cache_dir:
+        required: False
+        default: /var/cache/ansible-nmcli
+        description:
+            - Where the 'files' read backend caches what it parsed, keyed by each file's mtime and size. Caching is skipped if the directory can't be written.
+            - NetworkManager's version and the features the module uses (Reapply, AddProperties, ObjectManager) are probed once per boot and kept here too. They let a change to an active connection be applied to its device at once with 'nmcli dev reapply', a new connection be made with a single 'con add', and profiles be enumerated with a single GetManagedObjects call. Without Reapply, or where NetworkManager can't apply a change in place, it takes effect the next time the connection is activated. The version is returned as C(nm_version).
+    render_root:
+        required: False
+        default: None
+        description:
+            - Render the connection as a keyfile below this directory (in etc/NetworkManager/system-connections) instead of configuring NetworkManager, e.g. into an image build chroot.
+            - Neither D-Bus nor nmcli are used. Files are written 0600 and a re-rendered profile keeps its UUID. state=absent removes the file.
+    agent_socket:
+        required: False
+        default: /run/ansible-nmcli/agent.sock
+        description:
+            - The Unix socket of a local reconciler agent, started with 'python nmcli.py --agent'. When the socket exists, planning and applying are done by the agent from its signal maintained index; otherwise the module talks to NetworkManager itself.
+            - Set to an empty string to never use an agent.
+    retries:
+        required: False
+        default: 3
+        description:
+            - How often to retry a call to NetworkManager that failed in a way that passes, i.e. nmcli exiting with 3 (timeout expired) or 8 (NetworkManager is not running), or a D-Bus NoReply, Timeout, ServiceUnknown or NameHasNoOwner error. An add or a delete is only retried on 8, since one that timed out may have been done. The retries made are returned as C(retries), by failed runs too.
+    retry_delay:
+        required: False
+        default: 1.0
+        description:
+            - The base delay in seconds between retries. It doubles with every retry, up to 30 seconds, and a random part of it is waited.
+    lock_file:
+        required: False
+        default: /run/lock/ansible-nmcli.lock
+        description:
+            - The file locked around the write phase, so that runs changing the same host (async jobs, the agent, other scripts taking the lock) queue up instead of racing each other in NetworkManager. Planning, check mode, C(show) and runs with nothing to change don't take the lock and never wait for it.
+            - The time spent waiting is returned as C(lock_wait).
+    lock_timeout:
+        required: False
+        default: 300
+        description:
+            - Seconds to wait for the lock before failing.
+    profile_dir:
+        required: False
+        default: None
+        description:
+            - Run the module under cProfile and dump the stats into a directory named after the host below this one, e.g. for 'python -m pstats' or snakeviz. The NMCLI_PROFILE_DIR environment variable does the same when this is not given.
+            - The result gets the dump's path and the top functions by cumulative time as C(profile).
+    profile_top:
+        required: False
+        default: 15
+        description:
+            - How many functions the C(profile) summary lists.
+    profile_max_mb:
+        required: False
+        default: 50
+        description:
+            - The most the dumps of a host may take up; the oldest are removed to stay below it.
+    plan_file:
+        required: False
+        default: None
+        description:
+            - Save the run's plan in this file on the host: the operations it takes, and the profile they were planned against, as its UUID and a digest of the properties the task sets. Meant for check mode (--check) ahead of a maintenance window.
+            - A file holds the plans of any number of connections, one per cname, so a loop or several tasks may share it. No agent is used.
+    apply_plan:
+        required: False
+        default: None
+        description:
+            - Run the plan plan_file saved in this file for cname, without listing the profiles or comparing settings again. Only the connection's own profile is read, with a single nmcli, and if it has been created, deleted or changed since the plan was made the task fails and nothing is applied.
+            - The other options of the task only name the connection; what is done is the plan's. No agent is used.
+    connections:
+        required: False
+        default: None
+        description:
+            - A list of option dicts, each run as if it were its own task, with the other options as defaults. The result has one entry per connection in C(results), and the task fails when any of them does.
+            - The nmcli action plugin in action_plugins/ uses this to turn a looped task into a single remote call per host.
 
 '''
 
@@ -369,6 +688,11 @@ tenant_ip: "192.168.200.21/23"
 # To change the property of a setting e.g. MTU, issue a command as follows:
 - nmcli: cname=my-eth1 mtu=9000 state=present
 
+# To build a bridge over two dummy ports, which need no hardware:
+- nmcli: cname=my-br0 ifname=br0 type=bridge ip4=192.168.100.100/24 state=present
+- nmcli: cname=my-br0-port{{item}} ifname=dummy{{item}} type=dummy master=my-br0 slave_type=bridge state=present
+  with_items: [0, 1]
+
     Exit Status's:
         - nmcli exits with status 0 if it succeeds, a value greater than 0 is
         returned if an error occurs.
@@ -386,20 +710,2126 @@ tenant_ip: "192.168.200.21/23"
 '''
 # import ansible.module_utils.basic
 import os
+import re
+import shlex
+import socket
+import struct
+import subprocess
 import syslog
 import sys
-import dbus
-from gi.repository import NetworkManager, NMClient
+import json
+import hashlib
+import random
+import tempfile
+import time
+import uuid
+import ConfigParser
+import cProfile
+import errno
+import pstats
+import fcntl
+from collections import OrderedDict
+
+try:
+    import dbus
+    from dbus.mainloop.glib import DBusGMainLoop
+    from gi.repository import GLib
+    HAS_DBUS=True
+except ImportError:
+    HAS_DBUS=False
+
+NM_SERVICE='org.freedesktop.NetworkManager'
+NM_SETTINGS_PATH='/org/freedesktop/NetworkManager/Settings'
+NM_SETTINGS_IFACE='org.freedesktop.NetworkManager.Settings'
+NM_CONNECTION_IFACE='org.freedesktop.NetworkManager.Settings.Connection'
+NM_PATH='/org/freedesktop/NetworkManager'
+NM_ACTIVE_IFACE='org.freedesktop.NetworkManager.Connection.Active'
+NM_DEVICE_IFACE='org.freedesktop.NetworkManager.Device'
+AGENT_SOCKET='/run/ansible-nmcli/agent.sock'
+LOCK_FILE='/run/lock/ansible-nmcli.lock'
+BOOT_ID_FILE='/proc/sys/kernel/random/boot_id'
+
+
+class ConnectionRecord(object):
+    """
+    One connection profile as seen by list_connection_info().
+    The identifying fields are plain attributes; the full settings are kept in
+    their raw form and only turned into native dicts, by decode, when first
+    asked for.  path is the D-Bus object path, or the file the profile was read
+    from when it did not come from NetworkManager.
+    """
+
+    __slots__=('id', 'uuid', 'type', 'interface', 'path', 'master', 'active', '_config', '_decode', '_settings')
+
+    def __init__(self, id, uuid, type, interface=None, path=None, master=None, active=False, config=None, decode=None, settings=None):
+        self.id=id
+        self.uuid=uuid
+        self.type=type
+        self.interface=interface
+        self.path=path
+        self.master=master
+        self.active=active
+        self._config=config
+        self._decode=decode or native_settings
+        self._settings=settings
+
+    @property
+    def settings(self):
+        if self._settings is None and self._config is not None:
+            self._settings=self._decode(self._config)
+            self._config=None
+        return self._settings
+
+    def as_dict(self, with_settings=False):
+        con=dict(id=self.id, uuid=self.uuid, type=self.type, interface=self.interface,
+                 path=self.path, master=self.master, active=self.active)
+        if with_settings:
+            con['settings']=self.settings
+        return con
+
+    def __repr__(self):
+        return '<ConnectionRecord %s %s %s>' % (self.id, self.uuid, self.type)
+
+
+def ip4_to_string(value):
+    # NetworkManager hands IPv4 addresses over as uint32 in network byte order
+    return socket.inet_ntoa(struct.pack('=I', int(value)))
+
+
+def ip6_to_string(value):
+    return socket.inet_ntop(socket.AF_INET6, bytes(bytearray(value)))
+
+
+def mac_to_string(value):
+    return ':'.join(['%02X' % int(byte) for byte in value])
+
+
+def ip4_addresses(value):
+    # aau: [address, prefix, gateway]
+    return ['%s/%d' % (ip4_to_string(address[0]), int(address[1])) for address in value]
+
+
+def ip6_addresses(value):
+    # a(ayuay): (address, prefix, gateway)
+    return ['%s/%d' % (ip6_to_string(address[0]), int(address[1])) for address in value]
+
+
+def ip4_routes(value):
+    # aau: [destination, prefix, next hop, metric]
+    return ['%s/%d %s %d' % (ip4_to_string(route[0]), int(route[1]), ip4_to_string(route[2]), int(route[3])) for route in value]
+
+
+def ip6_routes(value):
+    # a(ayuayu): (destination, prefix, next hop, metric)
+    return ['%s/%d %s %d' % (ip6_to_string(route[0]), int(route[1]), ip6_to_string(route[2]), int(route[3])) for route in value]
+
+
+# properties whose dbus encoding needs more than a type-driven conversion
+PROPERTY_CONVERTERS={
+    ('ipv4', 'addresses'): ip4_addresses,
+    ('ipv4', 'dns'): lambda value: [ip4_to_string(address) for address in value],
+    ('ipv4', 'routes'): ip4_routes,
+    ('ipv6', 'addresses'): ip6_addresses,
+    ('ipv6', 'dns'): lambda value: [ip6_to_string(address) for address in value],
+    ('ipv6', 'routes'): ip6_routes,
+}
+
+if HAS_DBUS:
+    DBUS_INTEGERS=(dbus.Byte, dbus.Int16, dbus.UInt16, dbus.Int32, dbus.UInt32, dbus.Int64, dbus.UInt64)
+    DBUS_STRINGS=(dbus.String, dbus.ObjectPath, dbus.Signature)
+
+
+def dbus_to_native(value, key=''):
+    # Convert a dbus value to plain, JSON-able Python in a single pass.  Byte
+    # arrays become MAC/IP strings where the key says what they hold.
+    if isinstance(value, dbus.Boolean):
+        return bool(value)
+    if isinstance(value, DBUS_INTEGERS):
+        return int(value)
+    if isinstance(value, dbus.Double):
+        return float(value)
+    if isinstance(value, DBUS_STRINGS):
+        return unicode(value)
+    if isinstance(value, dbus.Dictionary):
+        return dict((unicode(k), dbus_to_native(v, k)) for k, v in value.items())
+    if isinstance(value, dbus.ByteArray):
+        value=bytearray(value)
+    if isinstance(value, (dbus.Array, dbus.Struct, bytearray, list, tuple)):
+        if key.endswith('mac-address') or key=='bssid':
+            return mac_to_string(value)
+        if key=='ssid':
+            return bytes(bytearray(value)).decode('utf-8', 'replace')
+        return [dbus_to_native(v) for v in value]
+    return value
+
+
+def native_settings(config):
+    # a connection's settings as a dict of plain dicts, one per setting
+    settings={}
+    for setting_name, values in config.items():
+        setting_name=unicode(setting_name)
+        setting={}
+        for key, value in values.items():
+            key=unicode(key)
+            converter=PROPERTY_CONVERTERS.get((setting_name, key))
+            if converter is not None:
+                setting[key]=converter(value)
+            else:
+                setting[key]=dbus_to_native(value, key)
+        settings[setting_name]=setting
+    return settings
+
+
+KEYFILE_DIR='etc/NetworkManager/system-connections'
+IFCFG_DIR='etc/sysconfig/network-scripts'
+# keyfile group names that differ from the setting names used over D-Bus
+KEYFILE_SETTINGS={'ethernet': '802-3-ethernet',
+                  'wifi': '802-11-wireless',
+                  'wifi-security': '802-11-wireless-security',
+                  'infiniband': 'infiniband'}
+KEYFILE_OPTION=re.compile(r'(?P<option>[^=\s][^=]*?)\s*(?P<vi>=)\s*(?P<value>.*)$')
+# keyfile values that are ';' separated lists
+KEYFILE_LISTS=set(['dns', 'dns-search', 'dns-options', 'mac-address-blacklist'])
+# names, which stay strings whatever they look like
+KEYFILE_STRINGS=set(['connection.id', 'connection.interface-name', 'connection.master', 'connection.zone'])
+# editor and package manager leftovers NetworkManager does not load either
+BACKUP_SUFFIXES=('~', '.bak', '.orig', '.rej', '.rpmnew', '.rpmsave', '.rpmorig', '.swp', '.tmp')
+IFCFG_TYPES={'Ethernet': '802-3-ethernet',
+             'Bond': 'bond',
+             'Team': 'team',
+             'TeamPort': '802-3-ethernet',
+             'Bridge': 'bridge',
+             'Vlan': 'vlan',
+             'InfiniBand': 'infiniband'}
+
+
+def keyfile_number(prop):
+    # whether GetSettings() has prop as a number: the counts, and those
+    # properties PROPERTY_TYPES leaves out at an integer
+    convert, default=property_type(prop)
+    return convert is as_count or (isinstance(default, int) and not isinstance(default, bool))
+
+
+def keyfile_value(prop, value):
+    key=prop.split('.', 1)[1]
+    if prop in KEYFILE_STRINGS:
+        return value
+    if key in KEYFILE_LISTS:
+        return [item for item in value.split(';') if item]
+    if value in ('true', 'false'):
+        return value=='true'
+    if key.endswith('mac-address'):
+        return value.upper()
+    if keyfile_number(prop) and re.match(r'^-?[0-9]+$', value):
+        return int(value)
+    return value
+
+
+def parse_keyfile(path):
+    # Read a NetworkManager keyfile into settings shaped like native_settings()
+    # makes of GetSettings(), so both can be compared the same way
+    parser=ConfigParser.RawConfigParser()
+    parser.optionxform=str
+    # like GKeyFile, split on '=' only; tc keys such as qdisc.1:1 hold colons
+    parser._optcre=KEYFILE_OPTION
+    parser.read(path)
+    settings={}
+    for section in parser.sections():
+        setting_name=KEYFILE_SETTINGS.get(section, section)
+        setting=settings.setdefault(setting_name, {})
+        addresses=[]
+        for key, value in parser.items(section):
+            match=re.match(r'^address(es)?([0-9]*)$', key)
+            if setting_name in ('ipv4', 'ipv6') and match:
+                # addressN=address/prefix[,gateway]
+                address, _, gateway=value.partition(',')
+                addresses.append((int(match.group(2) or 0), address.strip()))
+                if gateway and 'gateway' not in setting:
+                    setting['gateway']=gateway.strip()
+            elif setting_name=='bond' and key!='interface-name':
+                setting.setdefault('options', {})[key]=value
+            elif setting_name=='tc' and key.split('.')[0] in ('qdisc', 'tfilter'):
+                setting.setdefault(key.split('.')[0] + 's', []).append(tc_keyfile_text(key, value))
+            else:
+                setting[key]=keyfile_value('%s.%s' % (setting_name, key), value)
+        if addresses:
+            setting['addresses']=[address for index, address in sorted(addresses)]
+    s_con=settings.setdefault('connection', {})
+    s_con['type']=KEYFILE_SETTINGS.get(s_con.get('type'), s_con.get('type'))
+    if 'uuid' not in s_con:
+        s_con['uuid']=uuid_from_path(path)
+    if 'id' not in s_con:
+        s_con['id']=os.path.basename(path).rsplit('.nmconnection', 1)[0]
+    return settings
+
+
+def uuid_from_path(path):
+    # what NetworkManager makes up for profiles that carry no UUID themselves
+    return str(uuid.UUID(bytes=hashlib.md5(path).digest()))
+
+
+def netmask_to_prefix(netmask):
+    return sum([bin(int(octet)).count('1') for octet in netmask.split('.')])
+
+
+def parse_ifcfg(path):
+    # Read an initscripts ifcfg file into settings shaped like native_settings()
+    values={}
+    for line in open(path):
+        line=line.strip()
+        if not line or line.startswith('#') or '=' not in line:
+            continue
+        key, value=line.split('=', 1)
+        try:
+            values[key.strip()]=' '.join(shlex.split(value))
+        except ValueError:
+            continue
+
+    device=values.get('DEVICE') or os.path.basename(path)[len('ifcfg-'):]
+    con_type=IFCFG_TYPES.get(values.get('TYPE') or values.get('DEVICETYPE'), '802-3-ethernet')
+    if values.get('VLAN')=='yes':
+        con_type='vlan'
+    elif values.get('BONDING_OPTS') and 'TYPE' not in values:
+        con_type='bond'
+    elif values.get('DEVICETYPE')=='Team':
+        con_type='team'
+    s_con={'id': values.get('NAME') or 'System %s' % device,
+           'uuid': values.get('UUID') or uuid_from_path(path),
+           'type': con_type,
+           'interface-name': device,
+           'autoconnect': values.get('ONBOOT', 'yes')!='no'}
+    for key, slave_type in (('MASTER', 'bond'), ('TEAM_MASTER', 'team'), ('BRIDGE', 'bridge')):
+        if values.get(key):
+            s_con['master']=values[key]
+            s_con['slave-type']=slave_type
+    settings={'connection': s_con}
+
+    s_ip4={}
+    addresses=[]
+    for index in [''] + [str(n) for n in range(256)]:
+        address=values.get('IPADDR' + index)
+        if address is None:
+            if index not in ('', '0', '1'):
+                break
+            continue
+        prefix=values.get('PREFIX' + index)
+        if prefix is None and values.get('NETMASK' + index):
+            prefix=netmask_to_prefix(values['NETMASK' + index])
+        addresses.append('%s/%s' % (address, prefix or 32))
+    if values.get('BOOTPROTO') in ('dhcp', 'bootp'):
+        s_ip4['method']='auto'
+    elif addresses:
+        s_ip4['method']='manual'
+    else:
+        s_ip4['method']='disabled'
+    s_ip4['addresses']=addresses
+    if values.get('GATEWAY'):
+        s_ip4['gateway']=values['GATEWAY']
+    dns=[values['DNS%d' % n] for n in range(1, 10) if values.get('DNS%d' % n)]
+    s_ip4['dns']=[server for server in dns if ':' not in server]
+    if values.get('DOMAIN'):
+        s_ip4['dns-search']=values['DOMAIN'].split()
+    settings['ipv4']=s_ip4
+
+    if values.get('IPV6INIT')=='yes':
+        s_ip6={'addresses': ([values['IPV6ADDR']] if values.get('IPV6ADDR') else []) + values.get('IPV6ADDR_SECONDARIES', '').split()}
+        if values.get('IPV6_AUTOCONF', 'yes')=='yes' and not s_ip6['addresses']:
+            s_ip6['method']='auto'
+        else:
+            s_ip6['method']='manual'
+        if values.get('IPV6_DEFAULTGW'):
+            s_ip6['gateway']=values['IPV6_DEFAULTGW']
+        s_ip6['dns']=[server for server in dns if ':' in server]
+    else:
+        s_ip6={'method': 'ignore'}
+    settings['ipv6']=s_ip6
+
+    if con_type=='802-3-ethernet':
+        s_wired={}
+        if values.get('MTU'):
+            s_wired['mtu']=int(values['MTU'])
+        if values.get('HWADDR'):
+            s_wired['mac-address']=values['HWADDR'].upper()
+        settings['802-3-ethernet']=s_wired
+    if values.get('BONDING_OPTS'):
+        settings['bond']={'options': dict(option.split('=', 1) for option in values['BONDING_OPTS'].split() if '=' in option)}
+    return settings
+
+
+class ConnectionFileReader(object):
+    """
+    Reads connection profiles straight from the keyfile and ifcfg directories
+    below root, without involving NetworkManager.  The identifying fields of
+    every file are cached in cache_dir keyed by path, mtime and size, so only
+    files that changed since the previous run are parsed again.
+    """
+
+    CACHE_VERSION=1
+
+    def __init__(self, root='/', cache_dir=None):
+        self.root=root
+        self.cache_dir=cache_dir
+
+    def files(self):
+        # (path, parser) for every profile file NetworkManager would load
+        for directory, prefix, parser in ((KEYFILE_DIR, '', parse_keyfile), (IFCFG_DIR, 'ifcfg-', parse_ifcfg)):
+            directory=os.path.join(self.root, directory)
+            try:
+                names=sorted(os.listdir(directory))
+            except OSError:
+                continue
+            for name in names:
+                if name.startswith('.') or not name.startswith(prefix) or name.endswith(BACKUP_SUFFIXES):
+                    continue
+                if name=='ifcfg-lo':
+                    continue
+                yield os.path.join(directory, name), parser
+
+    def cache_file(self):
+        return os.path.join(self.cache_dir, 'files-%s.json' % hashlib.md5(os.path.abspath(self.root)).hexdigest())
+
+    def load_cache(self):
+        if not self.cache_dir:
+            return {}
+        try:
+            cache=json.load(open(self.cache_file()))
+        except (IOError, OSError, ValueError):
+            return {}
+        if cache.get('version')!=self.CACHE_VERSION:
+            return {}
+        return cache.get('files', {})
+
+    def save_cache(self, files):
+        if not self.cache_dir:
+            return
+        try:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir, 0700)
+            fd, tmp=tempfile.mkstemp(dir=self.cache_dir)
+            f=os.fdopen(fd, 'w')
+            json.dump({'version': self.CACHE_VERSION, 'files': files}, f)
+            f.close()
+            os.rename(tmp, self.cache_file())
+        except (IOError, OSError):
+            pass
+
+    def connections(self):
+        cache=self.load_cache()
+        files={}
+        connection_list=[]
+        for path, parser in self.files():
+            try:
+                st=os.stat(path)
+            except OSError:
+                continue
+            stamp=[st.st_mtime, st.st_size]
+            entry=cache.get(path)
+            settings=None
+            if entry is None or entry['stamp']!=stamp:
+                try:
+                    settings=parser(path)
+                except (IOError, OSError, ConfigParser.Error, ValueError):
+                    continue
+                s_con=settings['connection']
+                entry={'stamp': stamp,
+                       'record': {'id': s_con.get('id'),
+                                  'uuid': s_con.get('uuid'),
+                                  'type': s_con.get('type'),
+                                  'interface': s_con.get('interface-name') or None,
+                                  'master': s_con.get('master') or None}}
+            files[path]=entry
+            record=entry['record']
+            connection_list.append(ConnectionRecord(record['id'], record['uuid'], record['type'],
+                                                    interface=record['interface'],
+                                                    path=path,
+                                                    master=record['master'],
+                                                    active=None,
+                                                    config=path,
+                                                    decode=parser,
+                                                    settings=settings))
+        if files!=cache:
+            self.save_cache(files)
+        return connection_list
+
+
+def split_list(value):
+    # '"8.8.8.8 8.8.4.4"', '8.8.8.8,8.8.4.4' or a list of either, as a list
+    if isinstance(value, (list, tuple)):
+        return [item for element in value for item in split_list(str(element))]
+    return [item for item in re.split(r'[\s,;]+', value.strip('"\' ')) if item]
+
+
+def as_feature(value):
+    # an ethtool feature as NetworkManager's on/off, or None to leave it alone
+    if value is None or str(value).lower() in ('', 'ignore'):
+        return None
+    return as_bool(value) and 'on' or 'off'
+
+
+def as_count(value):
+    # ring sizes and coalescing parameters; adaptive-rx/tx may be given as on/off
+    if isinstance(value, bool) or str(value).lower() in ('on', 'off', 'yes', 'no', 'true', 'false'):
+        return int(as_bool(value))
+    return int(value)
+
+
+# the ethtool_* params, the ethtool property prefix of their keys and how their values are spelled
+ETHTOOL_PARAMS=(('ethtool_features', 'feature-', as_feature),
+                ('ethtool_ring', 'ring-', as_count),
+                ('ethtool_coalesce', 'coalesce-', as_count))
+
+
+def ethtool_properties(params):
+    # {'tso': 'off'} or {'feature-tso': False} as ('ethtool.feature-tso', 'off'),
+    # in a stable order
+    properties=[]
+    for param, prefix, convert in ETHTOOL_PARAMS:
+        for name, value in sorted((params[param] or {}).items()):
+            name=str(name).lower().replace('_', '-')
+            if not name.startswith(prefix):
+                name=prefix + name
+            value=convert(value)
+            properties.append(('ethtool.%s' % name, value is None and 'ignore' or str(value)))
+    return properties
+
+
+# the bond params, each named after the bond option it sets
+BOND_OPTIONS=['mode', 'primary', 'miimon', 'downdelay', 'updelay', 'arp_interval', 'arp_ip_target',
+              'xmit_hash_policy', 'lacp_rate', 'ad_select', 'all_slaves_active']
+# those 'nmcli con add' takes as shorthand options of its own
+BOND_ADD_OPTIONS=['mode', 'primary', 'miimon', 'downdelay', 'updelay', 'arp_interval', 'arp_ip_target']
+# the bond modes an option means anything in
+BOND_OPTION_MODES={'primary': ('active-backup', 'balance-tlb', 'balance-alb'),
+                   'xmit_hash_policy': ('balance-xor', '802.3ad', 'balance-tlb'),
+                   'lacp_rate': ('802.3ad',),
+                   'ad_select': ('802.3ad',)}
+
+
+# the mode a new bond gets when none is given
+BOND_DEFAULT_MODE='balance-rr'
+
+
+def bond_mode(record):
+    # an existing bond's mode; NetworkManager leaves out the default one
+    options=normalize('bond.options', current_value(record.settings or {}, 'bond.options'))
+    return options.get('mode', BOND_DEFAULT_MODE)
+
+
+def merge_bond_options(current, desired):
+    # The profile's bond options with the desired ones on top, less those the
+    # resulting mode has no use for, as 'mode=802.3ad,miimon=100'
+    options=dict(current)
+    options.update(desired)
+    mode=options.get('mode', BOND_DEFAULT_MODE)
+    for option, modes in BOND_OPTION_MODES.items():
+        if mode not in modes:
+            options.pop(option, None)
+    return ','.join(['%s=%s' % item for item in sorted(options.items())])
+
+
+def check_bond_options(params):
+    # refuse options the bond's mode would silently ignore; with no mode
+    # given, plan_changes() checks again once it knows the profile's
+    if params['mode'] is None:
+        return
+    for option, modes in sorted(BOND_OPTION_MODES.items()):
+        if params[option] is not None and params['mode'] not in modes:
+            raise NmcliError('%s only applies to bond mode %s, not %s' % (option, ' or '.join(modes), params['mode']))
+
+
+# the team runners tx_hash and tx_balancer mean anything to
+TEAM_HASH_RUNNERS=('loadbalance', 'lacp')
+# what teamd runs when the configuration names no runner
+TEAM_DEFAULT_RUNNER='roundrobin'
+
+
+def check_team_options(params):
+    # a runner of None is one not known yet, such as an existing team's
+    if params['runner'] is not None and params['runner'] not in TEAM_HASH_RUNNERS:
+        for option in ('runner_tx_hash', 'runner_tx_balancer_interval'):
+            if params[option] is not None:
+                raise NmcliError('%s only applies to team runner %s, not %s' % (option, ' or '.join(TEAM_HASH_RUNNERS), params['runner']))
+
+
+def team_runner(record):
+    # an existing team's runner, None where its settings aren't known
+    if record.settings is None:
+        return None
+    config=as_json(current_value(record.settings, 'team.config') or '{}')
+    if not isinstance(config, dict):
+        return None
+    return config.get('runner', {}).get('name', TEAM_DEFAULT_RUNNER)
+
+
+def merge_team_config(current, desired):
+    # The profile's teamd configuration with the desired runner and
+    # link_watch on top; a different runner replaces the old one's options
+    config=isinstance(current, dict) and dict(current) or {}
+    for key, value in desired.items():
+        if key=='runner' and isinstance(config.get(key), dict) and value.get('name', config[key].get('name'))==config[key].get('name'):
+            value=dict(config[key], **value)
+        config[key]=value
+    return json_text(config)
+
+
+def team_config(params):
+    # the team runner params as teamd configuration, or None if none are set
+    config={}
+    if params['runner'] is not None:
+        config['runner']={'name': params['runner']}
+    if params['runner_tx_hash'] is not None:
+        config.setdefault('runner', {})['tx_hash']=split_list(params['runner_tx_hash'])
+    if params['runner_tx_balancer_interval'] is not None:
+        config.setdefault('runner', {})['tx_balancer']={'name': 'basic', 'balancing_interval': int(params['runner_tx_balancer_interval'])}
+    if params['link_watch'] is not None:
+        config['link_watch']={'name': params['link_watch']}
+    return config or None
+
+
+def json_text(value):
+    # one spelling of a JSON document, whatever order its keys came in
+    return json.dumps(value, sort_keys=True, separators=(',', ':'))
+
+
+# tc parents with names of their own
+TC_H_ROOT=0xffffffff
+TC_H_INGRESS=0xfffffff1
+
+
+def tc_handle(value):
+    # a tc handle as nmcli spells it, '1234:' or '1:2'
+    try:
+        if isinstance(value, (int, long)):
+            major, minor=value >> 16, value & 0xffff
+        else:
+            major, _, minor=str(value).lower().partition(':')
+            major, minor=int(major or '0', 16), int(minor or '0', 16)
+    except ValueError:
+        return str(value)
+    return minor and '%x:%x' % (major, minor) or '%x:' % major
+
+
+def tc_text(item):
+    # a qdisc or filter, as given to nmcli or as a GetSettings() dict, in one spelling
+    if not isinstance(item, dict):
+        words=str(item).split()
+        for index, word in enumerate(words[:-1]):
+            if word in ('parent', 'handle'):
+                words[index + 1]=tc_handle(words[index + 1])
+        return ' '.join(words)
+    words=[]
+    parent=int(item.get('parent', TC_H_ROOT))
+    if parent==TC_H_ROOT:
+        words.append('root')
+    elif parent!=TC_H_INGRESS:
+        words.extend(['parent', tc_handle(parent)])
+    if int(item.get('handle', 0)):
+        words.extend(['handle', tc_handle(int(item['handle']))])
+    words.append(str(item['kind']))
+    for key, value in sorted((item.get('params') or {}).items()):
+        words.extend([str(key), str(value)])
+    action=item.get('action')
+    if action:
+        words.extend(['action', str(action['kind'])])
+        for key, value in sorted(action.items()):
+            if key!='kind':
+                words.extend([str(key), str(value)])
+    return ' '.join(words)
+
+
+def as_tc(value):
+    # qdiscs or filters: nmcli's comma separated form, a list, or GetSettings() dicts
+    if isinstance(value, basestring):
+        value=value.split(',')
+    return [tc_text(item) for item in value if isinstance(item, dict) or str(item).strip()]
+
+
+# types of software devices, which need no hardware
+VIRTUAL_TYPES=('dummy', 'veth')
+
+
+def is_port(params):
+    # a port of a bond, team or bridge, which has no IP configuration of its own
+    return params['type'] in ('team-slave', 'bond-slave') or (params['type'] in VIRTUAL_TYPES and params['master'] is not None)
+
+
+def autoconnect(params):
+    # enabled, or the older autoconnect spelling of it
+    if params['enabled'] is not None:
+        return params['enabled']
+    return params['autoconnect']
+
+
+def connection_properties(params):
+    # The param to setting mapping: the (nmcli property, value) pairs that
+    # describe a connection of params['type'].  modify_connection() hands them
+    # to 'nmcli con mod' and render_keyfile() writes them out as a keyfile.
+    con_type=params['type']
+    properties=[]
+    if con_type in ('team', 'bond', 'ethernet', 'bridge', 'vlan') or (con_type in VIRTUAL_TYPES and not is_port(params)):
+        # the method ahead of the addresses, which nmcli may otherwise take
+        # as a reason to switch it to manual
+        if params['method4'] is not None:
+            properties.append(('ipv4.method', params['method4']))
+        if params['method6'] is not None:
+            properties.append(('ipv6.method', params['method6']))
+        if params['ip4'] is not None:
+            properties.append(('ipv4.addresses', params['ip4']))
+        if params['gw4'] is not None:
+            properties.append(('ipv4.gateway', params['gw4']))
+        if params['dns4'] is not None:
+            properties.append(('ipv4.dns', ','.join(split_list(params['dns4']))))
+        if params['ip6'] is not None:
+            properties.append(('ipv6.addresses', params['ip6']))
+        if params['gw6'] is not None:
+            properties.append(('ipv6.gateway', params['gw6']))
+        if params['dns6'] is not None:
+            properties.append(('ipv6.dns', ','.join(split_list(params['dns6']))))
+        for prop, param in (('ipv4.dns-search', 'dns4_search'),
+                            ('ipv6.dns-search', 'dns6_search'),
+                            ('ipv4.dns-options', 'dns4_options'),
+                            ('ipv6.dns-options', 'dns6_options')):
+            if params[param] is not None:
+                properties.append((prop, ','.join(split_list(params[param]))))
+        for prop, param in (('ipv4.dns-priority', 'dns4_priority'), ('ipv6.dns-priority', 'dns6_priority')):
+            if params[param] is not None:
+                properties.append((prop, str(params[param])))
+        if params['route_metric4'] is not None:
+            properties.append(('ipv4.route-metric', str(params['route_metric4'])))
+        if params['route_metric6'] is not None:
+            properties.append(('ipv6.route-metric', str(params['route_metric6'])))
+        for prop, param in (('ipv4.dhcp-timeout', 'dhcp_timeout4'),
+                            ('ipv6.dhcp-timeout', 'dhcp_timeout6'),
+                            ('ipv4.dad-timeout', 'dad_timeout4'),
+                            ('ipv4.required-timeout', 'required_timeout4'),
+                            ('ipv6.required-timeout', 'required_timeout6')):
+            if params[param] is not None:
+                properties.append((prop, str(params[param])))
+        for prop, param in (('ipv4.may-fail', 'may_fail4'), ('ipv6.may-fail', 'may_fail6')):
+            if params[param] is not None:
+                properties.append((prop, params[param] and 'yes' or 'no'))
+        if params['addr_gen_mode6'] is not None:
+            properties.append(('ipv6.addr-gen-mode', params['addr_gen_mode6']))
+    if is_port(params) and params['master'] is not None:
+        properties.append(('connection.master', params['master']))
+    if con_type=='veth' and params['veth_peer'] is not None:
+        properties.append(('veth.peer', params['veth_peer']))
+    if con_type in ('ethernet', 'team-slave') and params['mtu'] is not None:
+        properties.append(('802-3-ethernet.mtu', params['mtu']))
+    if con_type in ('ethernet', 'team-slave', 'bond-slave') + VIRTUAL_TYPES:
+        properties.extend(ethtool_properties(params))
+    for prop, param in (('tc.qdiscs', 'tc_qdiscs'), ('tc.tfilters', 'tc_tfilters')):
+        if params[param] is not None:
+            properties.append((prop, ', '.join(as_tc(params[param]))))
+    if con_type=='team' and team_config(params) is not None:
+        properties.append(('team.config', json_text(team_config(params))))
+    if con_type=='team-slave' and params['team_port_priority'] is not None:
+        properties.append(('team-port.config', json_text({'prio': int(params['team_port_priority'])})))
+    if con_type=='bond':
+        options=[]
+        for option in BOND_OPTIONS:
+            value=params[option]
+            if isinstance(value, bool):
+                value=int(value)
+            if value is not None:
+                options.append('%s=%s' % (option, value))
+        if options:
+            properties.append(('bond.options', ','.join(options)))
+    if con_type in ('team', 'bond', 'ethernet') + VIRTUAL_TYPES and autoconnect(params) is not None:
+        properties.append(('connection.autoconnect', autoconnect(params)))
+    if params['autoconnect_slaves'] is not None:
+        properties.append(('connection.autoconnect-slaves', str(int(params['autoconnect_slaves']))))
+    for prop, param in (('connection.autoconnect-priority', 'autoconnect_priority'),
+                        ('connection.autoconnect-retries', 'autoconnect_retries'),
+                        ('connection.wait-device-timeout', 'wait_device_timeout')):
+        if params[param] is not None:
+            properties.append((prop, str(params[param])))
+    return properties
+
+
+# nmcli connection types as keyfile connection types, and the slave type they imply
+KEYFILE_TYPES={'ethernet': ('ethernet', None),
+               'team': ('team', None),
+               'team-slave': ('ethernet', 'team'),
+               'bond': ('bond', None),
+               'bond-slave': ('ethernet', 'bond'),
+               'bridge': ('bridge', None),
+               'vlan': ('vlan', None),
+               'dummy': ('dummy', None),
+               'veth': ('veth', None)}
+KEYFILE_GROUPS=dict((setting, group) for group, setting in KEYFILE_SETTINGS.items())
+
+
+def tc_keyfile_entry(kind, text):
+    words=text.split()
+    if words[0]=='root':
+        return ('%s.root' % kind, ' '.join(words[1:]))
+    if words[0]=='parent':
+        return ('%s.%s' % (kind, words[1]), ' '.join(words[2:]))
+    return ('%s.%s' % (kind, tc_handle(TC_H_INGRESS)), text)
+
+
+def tc_keyfile_text(key, value):
+    # the other way round, for parse_keyfile()
+    parent=key.split('.', 1)[1]
+    if parent=='root':
+        return 'root %s' % value
+    if parent==tc_handle(TC_H_INGRESS) and value.split()[0]=='ingress':
+        return value
+    return 'parent %s %s' % (parent, value)
+
+
+def keyfile_type_groups(params):
+    # the settings of bridges and vlans as keyfile groups, whose names are
+    # also nmcli's setting names; add_args() sets them with the shorthand
+    groups=[]
+    if params['type']=='bridge':
+        entries=[('stp', str(as_bool(params['stp'])).lower())]
+        for key, param in (('priority', 'priority'), ('forward-delay', 'forwarddelay'), ('hello-time', 'hellotime'),
+                           ('max-age', 'maxage'), ('ageing-time', 'ageingtime'), ('mac-address', 'mac')):
+            if params[param] is not None:
+                entries.append((key, str(params[param])))
+        groups.append(('bridge', entries))
+    if params['type']=='vlan':
+        entries=[('id', str(params['vlanid'])), ('parent', params['vlandev'])]
+        for key, param in (('flags', 'flags'), ('ingress-priority-map', 'ingress'), ('egress-priority-map', 'egress')):
+            if params[param] is not None:
+                entries.append((key, params[param]))
+        groups.append(('vlan', entries))
+    return groups
+
+
+def keyfile_groups(params, con_uuid):
+    # the connection described by params as keyfile groups of (key, value)
+    con_type, slave_type=KEYFILE_TYPES[params['type']]
+    groups=OrderedDict()
+    groups['connection']=[('id', params['cname']),
+                          ('uuid', con_uuid),
+                          ('type', con_type),
+                          ('interface-name', params['ifname'] or params['cname'])]
+    for group, entries in keyfile_type_groups(params):
+        groups.setdefault(group, []).extend(entries)
+    for prop, value in connection_properties(params):
+        setting, key=prop.split('.', 1)
+        entries=groups.setdefault(KEYFILE_GROUPS.get(setting, setting), [])
+        if key=='addresses':
+            for index, address in enumerate(split_list(value)):
+                entries.append(('address%d' % (index + 1), address))
+        elif key in ('dns', 'dns-search', 'dns-options'):
+            entries.append((key, ''.join(['%s;' % server for server in split_list(value)])))
+        elif prop=='bond.options':
+            entries.extend([tuple(option.split('=', 1)) for option in value.split(',')])
+        elif setting=='tc':
+            # qdisc.<parent>=<the rest>
+            for text in as_tc(value):
+                entries.append(tc_keyfile_entry(key[:-1], text))
+        elif prop=='connection.master':
+            entries.append(('master', value))
+            entries.append(('slave-type', slave_type or params['slave_type']))
+        elif value=='ignore':
+            continue
+        elif value in ('yes', 'no', 'on', 'off'):
+            entries.append((key, str(value in ('yes', 'on')).lower()))
+        else:
+            entries.append((key, str(value)))
+    if not is_port(params):
+        # ports carry no IP configuration of their own
+        for setting, default in (('ipv4', 'auto'), ('ipv6', 'auto')):
+            entries=groups.setdefault(setting, [])
+            if [key for key, value in entries if key=='method']:
+                continue
+            if [key for key, value in entries if key.startswith('address')]:
+                entries.insert(0, ('method', 'manual'))
+            else:
+                entries.insert(0, ('method', default))
+    return groups
+
+
+def keyfile_text(groups):
+    lines=[]
+    for group, entries in groups.items():
+        lines.append('[%s]' % group)
+        lines.extend(['%s=%s' % entry for entry in entries])
+        lines.append('')
+    return '\n'.join(lines)
+
+
+def render_keyfile(params, root, check_mode=False):
+    # Write the connection described by params below root as the keyfile
+    # NetworkManager would keep for it, without NetworkManager or nmcli.
+    # An existing file keeps its UUID.  Returns (changed, path).
+    directory=os.path.join(root, KEYFILE_DIR)
+    path=os.path.join(directory, '%s.nmconnection' % params['cname'].replace('/', '_'))
+    existing=None
+    con_uuid=None
+    if os.path.exists(path):
+        existing=open(path).read()
+        con_uuid=parse_keyfile(path)['connection']['uuid']
+    if params['state']=='absent':
+        if existing is not None and not check_mode:
+            os.unlink(path)
+        return existing is not None, path
+    params=check_new_connection(params)
+    text=keyfile_text(keyfile_groups(params, con_uuid or str(uuid.uuid4())))
+    if text==existing:
+        return False, path
+    if not check_mode:
+        if not os.path.isdir(directory):
+            os.makedirs(directory, 0755)
+        # mkstemp creates the file 0600, as NetworkManager requires of keyfiles
+        fd, tmp=tempfile.mkstemp(dir=directory, prefix='.nmcli-')
+        f=os.fdopen(fd, 'w')
+        f.write(text)
+        f.close()
+        os.rename(tmp, path)
+    return True, path
+
+
+def optional_str(value):
+    # dbus strings to str, with empty values as None
+    if value:
+        return str(value)
+    return None
+
+
+def connection_record(path, config, active):
+    # Get the details of the 'connection' setting of a GetSettings() reply
+    s_con=config['connection']
+    return ConnectionRecord(str(s_con['id']),
+                            str(s_con['uuid']),
+                            str(s_con['type']),
+                            interface=optional_str(s_con.get('interface-name')),
+                            path=str(path),
+                            master=optional_str(s_con.get('master')),
+                            active=active,
+                            config=config)
+
+
+class NmcliError(Exception):
+    pass
+
+
+# nmcli's messages untranslated, since editor_errors() and others read them
+NMCLI_ENVIRON={'LC_ALL': 'C'}
+
+
+def run_command(cmd, data=None):
+    # what NmcliClient runs nmcli with when it is not given AnsibleModule.run_command
+    process=subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, close_fds=True,
+                             env=dict(os.environ, **NMCLI_ENVIRON))
+    out, err=process.communicate(data)
+    return process.returncode, out, err
+
+
+def split_terse(line, maxsplit=-1):
+    # The fields of one line of 'nmcli -t' output.  Inside a field ':' and
+    # '\\' are escaped with a backslash; most lines have neither.
+    if '\\' not in line:
+        return line.split(':', maxsplit)
+    fields=['']
+    escaped=False
+    for char in line:
+        if escaped:
+            fields[-1]+=char
+            escaped=False
+        elif char=='\\':
+            escaped=True
+        elif char==':' and (maxsplit < 0 or len(fields) <= maxsplit):
+            fields.append('')
+        else:
+            fields[-1]+=char
+    return fields
+
+
+def parse_terse_settings(text):
+    # 'nmcli -t con show <profile>' output as {setting: {property: value}}.
+    # Unset properties ('--') are left out, like GetSettings() does, and so
+    # are the upper case sections describing an active connection.
+    settings={}
+    for line in text.splitlines():
+        fields=split_terse(line, 1)
+        if len(fields) < 2 or '.' not in fields[0]:
+            continue
+        setting, key=fields[0].split('.', 1)
+        if not setting.islower() or fields[1] in ('', '--'):
+            continue
+        settings.setdefault(setting, {})[key]=fields[1]
+    return settings
+
+
+# nmcli exit codes worth another try: 3 timeout expired, 8 NetworkManager is not running
+TRANSIENT_RC=(3, 8)
+NOT_RUNNING_RC=(8,)
+# D-Bus errors seen while NetworkManager is busy or restarting
+TRANSIENT_DBUS_ERRORS=('org.freedesktop.DBus.Error.NoReply',
+                       'org.freedesktop.DBus.Error.Timeout',
+                       'org.freedesktop.DBus.Error.TimedOut',
+                       'org.freedesktop.DBus.Error.ServiceUnknown',
+                       'org.freedesktop.DBus.Error.NameHasNoOwner')
+
+
+def transient_dbus_error(e):
+    return HAS_DBUS and isinstance(e, dbus.exceptions.DBusException) and e.get_dbus_name() in TRANSIENT_DBUS_ERRORS
+
+
+# What NetworkManager and nmcli can do, by the version they first could;
+# only what the module makes use of is probed.  Reapply ('nmcli dev
+# reapply') and AddProperties ('nmcli con add' taking setting.property
+# arguments) are nmcli's; ObjectManager is introspected where D-Bus can be
+# used, and only guessed from this otherwise.
+FEATURE_VERSIONS={'Reapply': (1, 2),
+                  'AddProperties': (1, 6),
+                  'ObjectManager': (1, 22)}
+DBUS_OBJECT_MANAGER='org.freedesktop.DBus.ObjectManager'
+
+
+def version_tuple(version):
+    return tuple([int(part) for part in re.findall(r'[0-9]+', version or '')[:3]])
+
+
+def supports(capabilities, feature):
+    # capabilities is None when nothing is known, which supports nothing
+    return capabilities is not None and feature in capabilities['features']
+
+
+def boot_id():
+    try:
+        return open(BOOT_ID_FILE).read().strip()
+    except (IOError, OSError):
+        return None
+
+
+class NmcliClient(object):
+    """
+    NetworkManager access for plan_changes() and apply_changes(), independent
+    of Ansible.  A client holds the system bus connection and a snapshot of
+    the connection profiles, so one long lived process can serve any number of
+    operations without reconnecting or re-importing anything.  The snapshot is
+    dropped whenever nmcli is run, since that may change the profiles.
+    Calls failing in a way that passes (see TRANSIENT_RC and
+    TRANSIENT_DBUS_ERRORS) are retried up to retries times, after a jittered
+    exponential backoff; retry_count counts the retries made.
+    """
+
+    bus=None
+    # settings whose secrets are merged into a connection's configuration
+    SECRET_SETTINGS=['802-11-wireless', '802-11-wireless-security', '802-1x', 'gsm', 'cdma', 'ppp']
+
+    def __init__(self, read_backend='auto', inflight=32, files_root='/', cache_dir=None, nmcli_path='nmcli', run_command=run_command,
+                 retries=3, retry_delay=1.0, retry_max_delay=30.0):
+        if read_backend=='auto':
+            read_backend=self.default_backend()
+        self.read_backend=read_backend
+        self.inflight=inflight
+        self.files_root=files_root
+        self.cache_dir=cache_dir
+        self.nmcli_path=nmcli_path
+        self.run_command=run_command
+        self.retries=retries
+        self.retry_delay=retry_delay
+        self.retry_max_delay=retry_max_delay
+        self.retry_count=0
+        # what a run cost, for the timing callback plugin
+        self.dbus_calls=0
+        self.nmcli_calls=0
+        self.read_time=0.0
+        self.profile_count=None
+        # see get_capabilities()
+        self.capabilities=None
+        # snapshot of the connection profiles, see get_connections()
+        self.connections=None
+        self.connection_index=None
+
+    def invalidate(self):
+        self.connections=None
+        self.connection_index=None
+
+    def execute_command(self, cmd, data=None):
+        # whatever nmcli does may change the profiles, so drop our snapshot
+        self.invalidate()
+        return self.run_command(cmd, data=data)
+
+    def retry_wait(self, attempt):
+        # full jitter: anywhere up to the doubling, capped delay, so that hosts
+        # failing together don't all come back at once
+        self.retry_count+=1
+        time.sleep(random.uniform(0, min(self.retry_max_delay, self.retry_delay * 2 ** attempt)))
+
+    def nmcli(self, args, data=None, transient=TRANSIENT_RC, read_only=False):
+        # read_only commands leave the snapshot alone
+        run=read_only and self.run_command or self.execute_command
+        attempt=0
+        while True:
+            self.nmcli_calls+=1
+            rc, out, err=run([self.nmcli_path] + list(args), data=data)
+            if rc not in transient or attempt >= self.retries:
+                return rc, out, err
+            self.retry_wait(attempt)
+            attempt+=1
+
+    def get_bus(self):
+        # one shared system bus connection, attached to a GLib main loop so that
+        # replies can be collected asynchronously by dbus_call_many()
+        if not HAS_DBUS:
+            raise NmcliError('dbus-python and PyGObject are needed to talk to NetworkManager')
+        if NmcliClient.bus is None:
+            NmcliClient.bus=dbus.SystemBus(mainloop=DBusGMainLoop())
+        return NmcliClient.bus
+
+    def dbus_call_many(self, calls):
+        # Issue a list of (path, interface, method, args) calls keeping up to
+        # self.inflight of them outstanding at once, instead of waiting for each
+        # round trip in turn.  Returns the replies and the errors, both in the
+        # same order as calls (None where a call failed or succeeded).
+        bus=self.get_bus()
+        self.dbus_calls+=len(calls)
+        loop=GLib.MainLoop()
+        replies=[None] * len(calls)
+        errors=[None] * len(calls)
+        state={'next': 0, 'pending': 0}
+
+        def issue():
+            while state['next'] < len(calls) and state['pending'] < max(self.inflight, 1):
+                index=state['next']
+                path, interface, method, args=calls[index]
+                state['next']+=1
+                state['pending']+=1
+                on_reply, on_error=handlers(index)
+                proxy=bus.get_object(NM_SERVICE, path, introspect=False)
+                proxy.get_dbus_method(method, interface)(*args, reply_handler=on_reply, error_handler=on_error)
+
+        def finish():
+            state['pending']-=1
+            issue()
+            if state['pending']==0:
+                loop.quit()
+
+        def handlers(index):
+            def on_reply(*reply):
+                if reply:
+                    replies[index]=reply[0]
+                finish()
+
+            def on_error(e):
+                errors[index]=e
+                finish()
+            return on_reply, on_error
+
+        issue()
+        if state['pending']:
+            loop.run()
+        return replies, errors
+
+    def merge_secrets(self, config, setting_name, secrets):
+        # secrets is a dict of dicts mapping name::setting, where setting is a dict
+        # mapping key::value.  Each member of the 'setting' dict is a secret
+        # Copy the secrets into our connection config
+        for setting in secrets:
+            for key in secrets[setting]:
+                config[setting_name][key]=secrets[setting][key]
+
+    def default_backend(self):
+        # D-Bus where python-dbus is there, nmcli itself where it is not
+        return HAS_DBUS and 'dbus' or 'nmcli'
+
+    def list_connection_info(self):
+        if self.read_backend=='files':
+            return ConnectionFileReader(self.files_root, self.cache_dir).connections()
+        if self.read_backend=='nmcli':
+            return self.list_connection_nmcli()
+        attempt=0
+        while True:
+            try:
+                return self.list_connection_dbus()
+            except Exception, e:
+                if not transient_dbus_error(e) or attempt >= self.retries:
+                    if HAS_DBUS and isinstance(e, dbus.exceptions.DBusException):
+                        raise NmcliError('Could not list the connections over D-Bus: %s' % e)
+                    raise
+            self.retry_wait(attempt)
+            attempt+=1
+
+    def verify_with_networkmanager(self):
+        # The files backend only answers read only questions.  Before writing,
+        # take NetworkManager's own view, since that is what nmcli will act on.
+        # Returns whether the snapshot had to be dropped for it.
+        if self.read_backend!='files':
+            return False
+        self.read_backend=self.default_backend()
+        self.invalidate()
+        return True
+
+    def capabilities_file(self):
+        return os.path.join(self.cache_dir, 'capabilities.json')
+
+    def get_capabilities(self, probe=True):
+        # NetworkManager's version and features, probed once and cached in
+        # cache_dir until the host reboots.  With probe False only what is
+        # already known is returned, or None.
+        if self.capabilities is None and self.cache_dir:
+            try:
+                cached=json.load(open(self.capabilities_file()))
+                # a cache from a module that probed other features is no use
+                if cached.get('boot_id')==boot_id() and cached.get('probe')==self.probe_method() and cached.get('known')==sorted(FEATURE_VERSIONS):
+                    self.capabilities=cached
+            except (IOError, OSError, ValueError):
+                pass
+        if self.capabilities is None and probe:
+            self.capabilities=self.probe_capabilities()
+            if self.capabilities['version'] is not None and self.cache_dir:
+                try:
+                    if not os.path.isdir(self.cache_dir):
+                        os.makedirs(self.cache_dir, 0700)
+                    fd, tmp=tempfile.mkstemp(dir=self.cache_dir)
+                    f=os.fdopen(fd, 'w')
+                    json.dump(self.capabilities, f)
+                    f.close()
+                    os.rename(tmp, self.capabilities_file())
+                except (IOError, OSError):
+                    pass
+        return self.capabilities
+
+    def probe_method(self):
+        return HAS_DBUS and 'dbus' or 'nmcli'
+
+    def probe_capabilities(self):
+        # One round of calls: the Version property and an introspection
+        # over D-Bus, or 'nmcli --version' without it.  A failed probe knows
+        # nothing and is not cached.
+        capabilities={'probe': self.probe_method(), 'boot_id': boot_id(), 'version': None, 'features': [], 'known': sorted(FEATURE_VERSIONS)}
+        introspected={}
+        try:
+            if HAS_DBUS:
+                replies, errors=self.dbus_call_many([(NM_PATH, dbus.PROPERTIES_IFACE, 'Get', (NM_SERVICE, 'Version')),
+                                                     ('/org/freedesktop', 'org.freedesktop.DBus.Introspectable', 'Introspect', ())])
+                if replies[0] is None:
+                    return capabilities
+                capabilities['version']=str(replies[0])
+                introspected['ObjectManager']=DBUS_OBJECT_MANAGER in (replies[1] or '')
+            else:
+                rc, out, err=self.nmcli(['--version'], read_only=True)
+                if rc!=0 or not version_tuple(out):
+                    return capabilities
+                capabilities['version']='.'.join([str(part) for part in version_tuple(out)])
+        except Exception:
+            return capabilities
+        version=version_tuple(capabilities['version'])
+        for feature, since in sorted(FEATURE_VERSIONS.items()):
+            if introspected.get(feature, version >= since):
+                capabilities['features'].append(feature)
+        return capabilities
+
+    def list_connection_nmcli(self):
+        # Two terse 'nmcli con show' calls for every profile: the list, and the
+        # connection setting of all of them, for the interface name and master
+        # the list doesn't have.  The rest of a profile's settings are only
+        # asked for, with another nmcli call, when they are needed.
+        rc, out, err=self.nmcli(['-t', '-f', 'UUID,ACTIVE', 'con', 'show'], read_only=True)
+        if rc!=0:
+            raise NmcliError('nmcli con show failed: %s' % err.strip())
+        active={}
+        spec=[]
+        for line in out.splitlines():
+            fields=split_terse(line)
+            if len(fields) >= 2:
+                active[fields[0]]=fields[1]=='yes'
+                spec.extend(['uuid', fields[0]])
+        if not spec:
+            return []
+        # a profile deleted in between is left out, with rc 10
+        rc, out, err=self.nmcli(['-t', '-f', 'connection.id,connection.uuid,connection.type,connection.interface-name,connection.master', 'con', 'show'] + spec, read_only=True)
+        if rc not in (0, 10):
+            raise NmcliError('nmcli con show failed: %s' % err.strip())
+        profiles=[]
+        for line in out.splitlines():
+            fields=split_terse(line, 1)
+            if len(fields) < 2:
+                continue
+            if fields[0]=='connection.id':
+                profiles.append({})
+            if profiles:
+                profiles[-1][fields[0]]=fields[1] not in ('', '--') and fields[1] or None
+        connection_list=[]
+        for profile in profiles:
+            con_uuid=profile.get('connection.uuid')
+            if con_uuid not in active:
+                continue
+            connection_list.append(ConnectionRecord(profile['connection.id'], con_uuid, profile.get('connection.type'),
+                                                    interface=profile.get('connection.interface-name'),
+                                                    master=profile.get('connection.master'),
+                                                    active=active[con_uuid],
+                                                    config=con_uuid,
+                                                    decode=self.settings_nmcli))
+        return connection_list
+
+    def profile_settings(self, *spec):
+        # One profile's settings from nmcli ('uuid', <uuid> or a name),
+        # without listing any other; None if there is no such profile
+        rc, out, err=self.nmcli(['-t', 'con', 'show'] + list(spec), read_only=True)
+        if rc==10:
+            return None
+        if rc!=0:
+            raise NmcliError('nmcli con show %s failed: %s' % (' '.join(spec), err.strip()))
+        return parse_terse_settings(out)
+
+    def settings_nmcli(self, con_uuid):
+        rc, out, err=self.nmcli(['-t', 'con', 'show', 'uuid', con_uuid], read_only=True)
+        if rc!=0:
+            raise NmcliError('nmcli con show %s failed: %s' % (con_uuid, err.strip()))
+        return parse_terse_settings(out)
+
+    def list_connection_dbus(self):
+        # Ask the settings service for the list of connections it provides
+        bus=self.get_bus()
+        managed=None
+        if supports(self.get_capabilities(), 'ObjectManager'):
+            # one call for the profiles and the active connections both
+            managed=bus.get_object(NM_SERVICE, '/org/freedesktop', introspect=False).GetManagedObjects(dbus_interface=DBUS_OBJECT_MANAGER)
+            connection_paths=[path for path, interfaces in sorted(managed.items()) if NM_CONNECTION_IFACE in interfaces]
+        else:
+            settings=dbus.Interface(bus.get_object(NM_SERVICE, NM_SETTINGS_PATH), NM_SETTINGS_IFACE)
+            connection_paths=settings.ListConnections()
+        self.dbus_calls+=1
+
+        # Fetch every connection's settings in a pipelined batch; a profile
+        # removed since ListConnections() simply fails and is skipped,
+        configs, errors=self.dbus_call_many([(path, NM_CONNECTION_IFACE, 'GetSettings', ()) for path in connection_paths])
+        # but one that timed out is not gone, and must not look like it is
+        for e in errors:
+            if transient_dbus_error(e):
+                raise e
+        configs=[(path, config) for path, config in zip(connection_paths, configs) if config is not None]
+
+        # Now get secrets too; we grab the secrets for each type of connection
+        # (since there isn't a "get all secrets" call because most of the time
+        # you only need 'wifi' secrets or '802.1x' secrets, not everything) and
+        # merge that into the configuration data - To use at a later stage.
+        # Only settings a profile actually carries can hold secrets, so ask for
+        # those alone rather than for every secret setting of every profile.
+        wanted=[(path, config, setting_name) for path, config in configs for setting_name in self.SECRET_SETTINGS if setting_name in config]
+        secrets, errors=self.dbus_call_many([(path, NM_CONNECTION_IFACE, 'GetSecrets', (setting_name,)) for path, config, setting_name in wanted])
+        for (path, config, setting_name), secret in zip(wanted, secrets):
+            if secret is not None:
+                self.merge_secrets(config, setting_name, secret)
+
+        # Ask the manager which profiles are currently active
+        active_paths=set()
+        if managed is not None:
+            for path, interfaces in managed.items():
+                if NM_ACTIVE_IFACE in interfaces:
+                    active_paths.add(str(interfaces[NM_ACTIVE_IFACE].get('Connection')))
+        else:
+            manager=bus.get_object(NM_SERVICE, NM_PATH, introspect=False)
+            active_connections=manager.Get(NM_SERVICE, 'ActiveConnections', dbus_interface=dbus.PROPERTIES_IFACE)
+            self.dbus_calls+=1
+            replies, errors=self.dbus_call_many([(path, dbus.PROPERTIES_IFACE, 'Get', (NM_ACTIVE_IFACE, 'Connection')) for path in active_connections])
+            for reply in replies:
+                if reply is not None:
+                    active_paths.add(str(reply))
+
+        # Record each connection's name, UUID, type, interface and master
+        return [connection_record(path, config, str(path) in active_paths) for path, config in configs]
+
+    def get_connections(self):
+        # the profiles are enumerated once and reused until nmcli is run again
+        if self.connections is None:
+            start=time.time()
+            self.connections=self.list_connection_info()
+            self.read_time+=time.time() - start
+            self.profile_count=len(self.connections)
+            self.connection_index={}
+            for con in self.connections:
+                self.connection_index.setdefault(con.uuid, con)
+            for con in self.connections:
+                self.connection_index.setdefault(con.id, con)
+        return self.connections
+
+    def find_connection(self, name):
+        # look a profile up by its name or its UUID, as nmcli itself does
+        self.get_connections()
+        return self.connection_index.get(name)
+
+
+# NetworkManager connection types as the module's types
+MODULE_TYPES={'802-3-ethernet': 'ethernet',
+              'team': 'team',
+              'bond': 'bond',
+              'bridge': 'bridge',
+              'vlan': 'vlan',
+              'dummy': 'dummy',
+              'veth': 'veth'}
+
+
+def record_type(record):
+    # the module type of an existing profile, ports included
+    con_type=MODULE_TYPES.get(record.type, record.type)
+    slave_type=(record.settings or {}).get('connection', {}).get('slave-type')
+    if con_type=='ethernet' and slave_type in ('team', 'bond'):
+        return '%s-slave' % slave_type
+    return con_type
+
+
+def as_bool(value):
+    if isinstance(value, bool):
+        return value
+    return str(value).lower() in ('yes', 'true', 'on', '1')
+
+
+def as_ternary(value):
+    # yes/no/default settings as 1, 0 or -1, whether D-Bus's number, nmcli's
+    # '-1 (default)' or a word
+    if isinstance(value, bool):
+        return int(value)
+    words=str(value).lower().split()
+    if not words or words[0] in ('-1', 'default'):
+        return -1
+    return int(as_bool(words[0]))
+
+
+# ipv6.addr-gen-mode as D-Bus numbers it
+ADDR_GEN_MODES={0: 'eui64', 1: 'stable-privacy', 2: 'default-or-eui64', 3: 'default'}
+
+
+def as_addr_gen_mode(value):
+    if str(value).isdigit():
+        return ADDR_GEN_MODES.get(int(value), str(value))
+    return str(value)
+
+
+def leading_int(value):
+    # nmcli follows some numbers with what they mean, as in '-1 (default)'
+    return int(str(value).split()[0])
+
+
+def as_ip(value):
+    # one spelling per address, so '2001:db8:0::1' equals '2001:db8::1'
+    value=str(value).strip()
+    if ':' in value:
+        try:
+            return socket.inet_ntop(socket.AF_INET6, socket.inet_pton(socket.AF_INET6, value))
+        except (socket.error, ValueError):
+            return value
+    return value
+
+
+def as_set(value):
+    # search domains and resolver options, in whatever order they came
+    return sorted(set([item.lower().rstrip('.') for item in split_list(value)]))
+
+
+def as_addresses(value):
+    addresses=[]
+    for address in split_list(value):
+        address, _, prefix=address.partition('/')
+        address=as_ip(address)
+        addresses.append('%s/%s' % (address, prefix or (':' in address and '128' or '32')))
+    return addresses
+
+
+def as_options(value):
+    # 'mode=802.3ad,miimon=100' or a dict, as a dict of strings
+    if isinstance(value, dict):
+        return dict((str(key), str(option)) for key, option in value.items())
+    return dict(option.split('=', 1) for option in value.split(',') if '=' in option)
+
+
+def as_json(value):
+    if isinstance(value, dict):
+        return value
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+
+def json_contains(current, desired):
+    # Whether the teamd configuration current has everything desired asks
+    # for; NetworkManager and teamd fill in the rest.  Lists, such as tx_hash,
+    # are compared in any order.
+    if isinstance(desired, dict):
+        return isinstance(current, dict) and all([key in current and json_contains(current[key], value) for key, value in desired.items()])
+    if isinstance(desired, list) and isinstance(current, list):
+        return sorted(current)==sorted(desired)
+    return current==desired
+
+
+# How to compare a property, and the value GetSettings() leaves it out at
+PROPERTY_TYPES={
+    'connection.autoconnect': (as_bool, True),
+    'connection.master': (str, None),
+    'connection.autoconnect-slaves': (as_ternary, -1),
+    'connection.autoconnect-priority': (leading_int, 0),
+    'connection.autoconnect-retries': (leading_int, -1),
+    'connection.wait-device-timeout': (leading_int, -1),
+    'ipv4.addresses': (as_addresses, []),
+    'ipv4.gateway': (as_ip, None),
+    'ipv4.dns': (lambda value: [as_ip(server) for server in split_list(value)], []),
+    'ipv6.addresses': (as_addresses, []),
+    'ipv6.gateway': (as_ip, None),
+    'ipv6.dns': (lambda value: [as_ip(server) for server in split_list(value)], []),
+    'ipv4.dns-search': (as_set, []),
+    'ipv6.dns-search': (as_set, []),
+    'ipv4.dns-options': (as_set, []),
+    'ipv6.dns-options': (as_set, []),
+    'ipv4.dns-priority': (leading_int, 0),
+    'ipv6.dns-priority': (leading_int, 0),
+    '802-3-ethernet.mtu': (lambda value: value!='auto' and int(value) or 0, 0),
+    'bond.options': (as_options, {}),
+    'ipv4.route-metric': (int, -1),
+    'ipv6.route-metric': (int, -1),
+    'ipv4.method': (str, None),
+    'ipv6.method': (str, None),
+    'ipv4.dhcp-timeout': (leading_int, 0),
+    'ipv6.dhcp-timeout': (leading_int, 0),
+    'ipv4.may-fail': (as_bool, True),
+    'ipv6.may-fail': (as_bool, True),
+    'ipv4.dad-timeout': (leading_int, -1),
+    'ipv4.required-timeout': (leading_int, -1),
+    'ipv6.required-timeout': (leading_int, -1),
+    'ipv6.addr-gen-mode': (as_addr_gen_mode, None),
+    'tc.qdiscs': (as_tc, []),
+    'tc.tfilters': (as_tc, []),
+    'team.config': (as_json, None),
+    'team-port.config': (as_json, None),
+}
+
+
+# the same for the properties named after what they set, by prefix
+PROPERTY_PREFIX_TYPES=(('ethtool.feature-', (as_feature, None)),
+                       ('ethtool.ring-', (as_count, None)),
+                       ('ethtool.coalesce-', (as_count, None)))
+
+
+def property_type(prop):
+    if prop in PROPERTY_TYPES:
+        return PROPERTY_TYPES[prop]
+    for prefix, prop_type in PROPERTY_PREFIX_TYPES:
+        if prop.startswith(prefix):
+            return prop_type
+    return (unicode, None)
+
+
+def normalize(prop, value):
+    convert, default=property_type(prop)
+    if value is None or value=='':
+        return default
+    return convert(value)
+
+
+def current_value(settings, prop):
+    setting, key=prop.split('.', 1)
+    return settings.get(setting, {}).get(key)
+
+
+def same_connection(snapshot, current, desired):
+    # masters may be given by name, UUID or interface name
+    if current==desired:
+        return True
+    if snapshot is None or current is None or desired is None:
+        return False
+    con=snapshot.find_connection(desired)
+    return con is not None and current in (con.id, con.uuid, con.interface)
+
+
+def diff_settings(record, properties, snapshot=None):
+    # The (property, current, desired) triples for those of properties whose
+    # desired value differs from what record currently has, in the given order.
+    settings=record.settings or {}
+    changes=[]
+    for prop, value in properties:
+        current=normalize(prop, current_value(settings, prop))
+        desired=normalize(prop, value)
+        if prop=='connection.master':
+            equal=same_connection(snapshot, current, desired)
+        elif prop=='bond.options':
+            # NetworkManager fills in defaults for the options we leave out
+            equal=all([current.get(key)==option for key, option in desired.items()])
+        elif prop in ('team.config', 'team-port.config'):
+            equal=json_contains(current, desired)
+        else:
+            equal=current==desired
+        if not equal:
+            changes.append((prop, current, desired))
+    return changes
+
+
+# properties 'nmcli con add' takes in its shorthand options
+ADD_PROPERTIES=set(['ipv4.addresses', 'ipv4.gateway', 'ipv6.addresses', 'ipv6.gateway',
+                    'connection.autoconnect', 'connection.master', 'bond.options', 'veth.peer'])
+
+
+def add_args(params):
+    # nmcli arguments creating the connection described by params, using the
+    # 'con add' shorthand options
+    con_type=params['type']
+    args=['con', 'add', 'type', con_type, 'con-name', params['cname'] or params['ifname'], 'ifname', params['ifname'] or params['cname']]
+    if con_type=='veth':
+        args.extend(['peer', params['veth_peer']])
+    if con_type=='vlan':
+        args.extend(['dev', params['vlandev'], 'id', str(params['vlanid'])])
+        for option in ('flags', 'ingress', 'egress'):
+            if params[option] is not None:
+                args.extend([option, params[option]])
+    if con_type=='bridge':
+        args.extend(['stp', as_bool(params['stp']) and 'yes' or 'no'])
+        for option, param in (('priority', 'priority'), ('forward-delay', 'forwarddelay'), ('hello-time', 'hellotime'),
+                              ('max-age', 'maxage'), ('ageing-time', 'ageingtime'), ('mac', 'mac')):
+            if params[param] is not None:
+                args.extend([option, str(params[param])])
+    if con_type in ('team-slave', 'bond-slave'):
+        args.extend(['master', params['master']])
+        return args
+    if is_port(params):
+        args.extend(['master', params['master'], 'slave-type', params['slave_type']])
+    else:
+        for option in ('ip4', 'gw4', 'ip6', 'gw6'):
+            if params[option] is not None:
+                args.extend([option, params[option]])
+    if autoconnect(params) is not None:
+        args.extend(['autoconnect', autoconnect(params)])
+    if con_type=='bond':
+        for option in BOND_ADD_OPTIONS:
+            if params[option] is not None:
+                args.extend([option.replace('_', '-'), params[option]])
+    return args
+
+
+def add_properties(params):
+    # the properties add_args() sets; bond.options only when each option set
+    # has a shorthand
+    properties=set(ADD_PROPERTIES)
+    if [option for option in BOND_OPTIONS if option not in BOND_ADD_OPTIONS and params[option] is not None]:
+        properties.discard('bond.options')
+    return properties
+
+
+def modify_args(name, properties):
+    args=['con', 'mod', name]
+    for prop, value in properties:
+        args.extend([prop, value])
+    return args
+
+
+def operation(op, name, args, **extra):
+    extra.update(op=op, name=name, args=args)
+    return extra
+
+
+def edit_script(properties):
+    # 'nmcli con edit' commands setting properties and saving the profile;
+    # the editor takes a value up to the end of its line.  Saving a profile
+    # that autoconnects would otherwise ask for a confirmation, which the
+    # next line would answer.
+    lines=['nmcli save-confirmation no']
+    methods=[prop for prop, value in properties if prop.endswith('.method')]
+    for prop, value in properties:
+        value=str(value)
+        if '\n' in value:
+            raise NmcliError('%s can not be set in an nmcli edit session, its value spans lines' % prop)
+        if prop in ('ipv4.addresses', 'ipv6.addresses') and value and '%s.method' % prop.split('.')[0] not in methods:
+            # otherwise the editor asks whether to change the method as well
+            lines.append('set %s.method manual' % prop.split('.')[0])
+        if value:
+            lines.append('set %s %s' % (prop, value))
+        else:
+            # 'set' with no value would prompt for one
+            lines.append('remove %s' % prop)
+    lines.extend(['save persistent', 'quit'])
+    return '\n'.join(lines) + '\n'
+
+
+def edit_add_properties(params):
+    # everything add_args() and connection_properties() describe, as
+    # properties for a new profile's edit session
+    con_type, slave_type=KEYFILE_TYPES[params['type']]
+    properties=[('connection.interface-name', params['ifname'] or params['cname'])]
+    if is_port(params):
+        properties.append(('connection.slave-type', slave_type or params['slave_type']))
+    for setting, entries in keyfile_type_groups(params):
+        properties.extend([('%s.%s' % (setting, key), value) for key, value in entries])
+    return properties + connection_properties(params)
+
+
+def editor_errors(out):
+    # nmcli con edit exits 0 whatever happened in the session, so its
+    # output is what tells
+    errors=[line.split('Error:', 1)[1].strip() for line in out.splitlines() if 'Error:' in line]
+    if not errors and 'successfully' not in out:
+        errors.append('nmcli con edit did not report saving the connection')
+    return errors
+
+
+def modify_operation(params, name, properties, **extra):
+    if params['write_method']=='edit':
+        return operation('modify', name, ['con', 'edit', name], data=edit_script(properties), editor=True, **extra)
+    return operation('modify', name, modify_args(name, properties), **extra)
+
+
+def plan_changes(params, snapshot, capabilities=None):
+    # Work out the nmcli operations that bring the connection described by
+    # params to the requested state, given snapshot (anything with
+    # find_connection(), such as an NmcliClient).  Nothing here writes; an
+    # empty list means there is nothing to do.  capabilities, from
+    # NmcliClient.get_capabilities(), allows for fewer commands where
+    # NetworkManager is new enough.
+    name=params['cname']
+    record=snapshot.find_connection(name)
+    if params['state']=='absent':
+        if record is None:
+            return []
+        # 'con del' takes an active connection down itself
+        return [operation('delete', name, ['con', 'del', name])]
+
+    if record is not None:
+        if params['type'] is None:
+            params=dict(params, type=record_type(record))
+        if params['type']=='bond':
+            check_bond_options(dict(params, mode=params['mode'] or bond_mode(record)))
+        if params['type']=='team':
+            check_team_options(dict(params, runner=params['runner'] or team_runner(record)))
+        changes=diff_settings(record, connection_properties(params), snapshot)
+        if not changes:
+            return []
+        properties=[]
+        for prop, current, desired in changes:
+            value=dict(connection_properties(params))[prop]
+            if prop=='bond.options':
+                # 'con mod' replaces all of them
+                value=merge_bond_options(current, desired)
+            if prop=='team.config':
+                value=merge_team_config(current, desired)
+            properties.append((prop, value))
+        operations=[modify_operation(params, name, properties, changes=changes)]
+        if record.active is True and record.interface is not None and supports(capabilities, 'Reapply'):
+            # 'con mod' leaves the active connection as it was until it is
+            # activated again; the profile is saved even if NetworkManager
+            # can't apply some change in place, so that is no failure
+            operations.append(operation('reapply', name, ['dev', 'reapply', record.interface], ignore_errors=True))
+        return operations
+
+    params=check_new_connection(params)
+    # what the 'con add' shorthand can't take is given to it as properties
+    # where it takes them, and set by a 'con mod' right after otherwise; the
+    # connection is brought up with it
+    rest=[(prop, value) for prop, value in connection_properties(params) if prop not in add_properties(params)]
+    if params['write_method']=='edit':
+        args=['con', 'edit', 'type', KEYFILE_TYPES[params['type']][0], 'con-name', name]
+        operations=[operation('add', name, args, data=edit_script(edit_add_properties(params)), editor=True)]
+    elif rest and supports(capabilities, 'AddProperties'):
+        operations=[operation('add', name, add_args(params) + modify_args(name, rest)[3:])]
+    else:
+        operations=[operation('add', name, add_args(params))]
+        if rest:
+            operations.append(modify_operation(params, name, rest))
+    if rest:
+        if not is_port(params):
+            operations.append(operation('up', name, ['con', 'up', name]))
+    return operations
+
+
+def check_new_connection(params):
+    # What a new profile needs, for plan_changes() and render_keyfile() both.
+    # Returns params with the defaults a new profile gets.
+    if params['type'] is None:
+        raise NmcliError("You haven't specified a type for the connection to add")
+    if params['type']=='bond':
+        params=dict(params, mode=params['mode'] or BOND_DEFAULT_MODE)
+        check_bond_options(params)
+    if params['type']=='team':
+        check_team_options(dict(params, runner=params['runner'] or TEAM_DEFAULT_RUNNER))
+    if params['type']=='veth' and params['veth_peer'] is None:
+        raise NmcliError('veth_peer is required to create a veth connection')
+    if is_port(params) and params['type'] in VIRTUAL_TYPES and params['slave_type'] is None:
+        raise NmcliError('slave_type is required to create a %s port of a master' % params['type'])
+    if params['type']=='vlan' and (params['vlanid'] is None or params['vlandev'] is None):
+        raise NmcliError('vlanid and vlandev are required to create a vlan connection')
+    return params
+
+
+def apply_changes(client, operations):
+    # Run planned operations in order, stopping at the first one that fails.
+    # Returns (rc, out, err) like run_command(); rc is None if there was nothing to do.
+    rc=None
+    out=[]
+    err=[]
+    for op in operations:
+        # an add or a delete that timed out may have been done all the same,
+        # so they are only tried again when NetworkManager wasn't there to see
+        # them
+        transient=op['op'] in ('add', 'delete') and NOT_RUNNING_RC or TRANSIENT_RC
+        rc, op_out, op_err=client.nmcli(op['args'], data=op.get('data'), transient=transient)
+        if rc==0 and op.get('editor') and editor_errors(op_out):
+            rc=1
+            op_err+=''.join(['Error: %s\n' % error for error in editor_errors(op_out)])
+        out.append(op_out)
+        err.append(op_err)
+        if rc!=0:
+            if not op.get('ignore_errors'):
+                break
+            rc=0
+    return rc, ''.join(out), ''.join(err)
+
+
+# the format of plan_file
+PLAN_VERSION=1
+
+
+def plan_digest(settings, props):
+    # the normalized values of props, so the same whichever backend read settings
+    values=[(prop, normalize(prop, current_value(settings, prop))) for prop in props]
+    return hashlib.sha1(json.dumps(values, sort_keys=True, default=str)).hexdigest()
+
+
+def plan_entry(params, record, operations):
+    # A plan for one connection, with what it was made against: no profile,
+    # or the profile's UUID and a digest of the properties params are about
+    entry=dict(name=params['cname'], operations=operations, created=int(time.time()), uuid=None, props=[], digest=None)
+    if record is not None:
+        params=dict(params, type=params['type'] or record_type(record))
+        entry['uuid']=record.uuid
+        entry['props']=[prop for prop, value in connection_properties(params)]
+        entry['digest']=plan_digest(record.settings or {}, entry['props'])
+    return entry
+
+
+def read_plans(path):
+    # the plans in path by connection name
+    if not os.path.exists(path):
+        return {}
+    plans=json.load(open(path))
+    if plans.get('version')!=PLAN_VERSION:
+        raise NmcliError('%s is not a plan file of this version of the module' % path)
+    return plans['plans']
+
+
+def write_plan(path, entry):
+    # a file holds the plans of any number of connections, say those of a
+    # loop, so entry replaces only the plan for its own
+    plans=read_plans(path)
+    plans[entry['name']]=entry
+    fd, tmp=tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix='.nmcli-plan-')
+    f=os.fdopen(fd, 'w')
+    json.dump(dict(version=PLAN_VERSION, plans=plans), f, indent=2, sort_keys=True)
+    f.close()
+    os.rename(tmp, path)
+
+
+def check_plan(client, entry):
+    # The cheap check before a saved plan runs: only its own profile is
+    # read, with a single nmcli.  Returns why the plan is stale, or None.
+    if entry['uuid'] is None:
+        if client.profile_settings(entry['name']) is not None:
+            return '%s has been created since the plan was made' % entry['name']
+        return None
+    settings=client.profile_settings('uuid', entry['uuid'])
+    if settings is None:
+        return '%s has been deleted since the plan was made' % entry['name']
+    if plan_digest(settings, entry['props'])!=entry['digest']:
+        return '%s has been changed since the plan was made' % entry['name']
+    return None
+
+
+class HostLock(object):
+    """
+    A host wide writer lock on a file, taken exclusively with flock(); reads
+    don't take it.  acquire() waits up to timeout seconds (for ever if None)
+    and returns how long it waited.
+    """
+
+    def __init__(self, path=LOCK_FILE, timeout=None):
+        self.path=path
+        self.timeout=timeout
+        self.fd=None
+
+    def acquire(self):
+        directory=os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory, 0755)
+        self.fd=os.open(self.path, os.O_RDWR | os.O_CREAT, 0600)
+        start=time.time()
+        delay=0.01
+        while True:
+            try:
+                fcntl.flock(self.fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return time.time() - start
+            except IOError, e:
+                if e.errno not in (errno.EAGAIN, errno.EACCES):
+                    raise
+            if self.timeout is not None and time.time() - start >= self.timeout:
+                os.close(self.fd)
+                self.fd=None
+                raise NmcliError('Timed out after %s seconds waiting for the lock on %s' % (self.timeout, self.path))
+            time.sleep(delay)
+            delay=min(delay * 2, 0.5)
+
+    def release(self):
+        if self.fd is not None:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+            os.close(self.fd)
+            self.fd=None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+class NmcliAgent(object):
+    """
+    A long running reconciler for one host.  It holds a single D-Bus
+    connection and an index of the connection profiles and devices that
+    NetworkManager's own signals keep current, and answers requests, one JSON
+    object per line, on a Unix socket.  Started with
+    'python nmcli.py --agent [socket]'; the module hands its work to the agent
+    when the socket is there and talks to NetworkManager itself otherwise.
+    """
+
+    def __init__(self, socket_path=AGENT_SOCKET, client=None, lock_file=LOCK_FILE):
+        self.socket_path=socket_path
+        self.client=client or NmcliClient()
+        self.lock_file=lock_file
+        # D-Bus path -> ConnectionRecord, and the id/uuid index built from it
+        self.records={}
+        self.index=None
+        # D-Bus path -> dict(interface, state)
+        self.devices={}
+        # GetSettings/GetAll replies still to come in
+        self.fetching=0
+        # counts refresh_active() calls, so an older one's replies are dropped
+        self.active_generation=0
+
+    # plan_changes() takes the agent itself as its snapshot
+    def get_connections(self):
+        return self.records.values()
+
+    def find_connection(self, name):
+        if self.index is None:
+            self.index={}
+            for con in self.records.values():
+                self.index.setdefault(con.uuid, con)
+            for con in self.records.values():
+                self.index.setdefault(con.id, con)
+        return self.index.get(name)
+
+    def load(self):
+        # start from one full enumeration, then follow the signals
+        self.client.invalidate()
+        self.records=dict((con.path, con) for con in self.client.list_connection_dbus())
+        self.index=None
+        bus=self.client.get_bus()
+        manager=dbus.Interface(bus.get_object(NM_SERVICE, NM_PATH), NM_SERVICE)
+        self.devices={}
+        for path in manager.GetDevices():
+            self.fetch_device(path)
+
+    def watch(self):
+        bus=self.client.get_bus()
+        bus.add_signal_receiver(self.connection_added, 'NewConnection', NM_SETTINGS_IFACE, NM_SERVICE, NM_SETTINGS_PATH)
+        bus.add_signal_receiver(self.connection_removed, 'ConnectionRemoved', NM_SETTINGS_IFACE, NM_SERVICE, NM_SETTINGS_PATH)
+        bus.add_signal_receiver(self.connection_updated, 'Updated', NM_CONNECTION_IFACE, NM_SERVICE, path_keyword='path')
+        bus.add_signal_receiver(self.properties_changed, 'PropertiesChanged', dbus.PROPERTIES_IFACE, NM_SERVICE, path_keyword='path')
+        # NetworkManager before 1.2 signals property changes on its own interface
+        bus.add_signal_receiver(self.manager_changed, 'PropertiesChanged', NM_SERVICE, NM_SERVICE, NM_PATH)
+        bus.add_signal_receiver(self.fetch_device, 'DeviceAdded', NM_SERVICE, NM_SERVICE, NM_PATH)
+        bus.add_signal_receiver(self.device_removed, 'DeviceRemoved', NM_SERVICE, NM_SERVICE, NM_PATH)
+        bus.add_signal_receiver(self.device_state_changed, 'StateChanged', NM_DEVICE_IFACE, NM_SERVICE, path_keyword='path')
+        # a restarted NetworkManager starts from scratch, and so do we
+        bus.watch_name_owner(NM_SERVICE, self.owner_changed)
+
+    def changed(self):
+        self.index=None
+
+    def call(self, path, interface, method, args, reply, error=None):
+        # an asynchronous call whose reply is counted until it is in
+        def on_reply(*values):
+            self.fetching-=1
+            reply(*values)
+
+        def on_error(e):
+            self.fetching-=1
+            if error is not None:
+                error(e)
+        self.fetching+=1
+        proxy=self.client.get_bus().get_object(NM_SERVICE, path, introspect=False)
+        proxy.get_dbus_method(method, interface)(*args, reply_handler=on_reply, error_handler=on_error)
+
+    def fetch_connection(self, path):
+        path=str(path)
+
+        def reply(config):
+            old=self.records.get(path)
+            self.records[path]=connection_record(path, config, old is not None and old.active)
+            self.changed()
+        self.call(path, NM_CONNECTION_IFACE, 'GetSettings', (), reply)
+
+    def connection_added(self, path):
+        self.fetch_connection(path)
+
+    def connection_updated(self, path=None):
+        if path in self.records:
+            self.fetch_connection(path)
+
+    def connection_removed(self, path):
+        if self.records.pop(str(path), None) is not None:
+            self.changed()
+
+    def refresh_active(self, active_connections):
+        # which profiles the given active connections are instances of; an
+        # active connection gone in the meantime counts as an answer too, and
+        # only the latest refresh gets to set the flags
+        self.active_generation+=1
+        generation=self.active_generation
+        active_paths=set()
+        remaining=[len(active_connections)]
+
+        def reply(path):
+            active_paths.add(str(path))
+            done()
+
+        def done(e=None):
+            remaining[0]-=1
+            if remaining[0]<=0 and generation==self.active_generation:
+                for con in self.records.values():
+                    con.active=con.path in active_paths
+        if not active_connections:
+            done()
+        for path in active_connections:
+            self.call(path, dbus.PROPERTIES_IFACE, 'Get', (NM_ACTIVE_IFACE, 'Connection'), reply, done)
+
+    def properties_changed(self, interface, changed, invalidated=None, path=None):
+        if path==NM_PATH and interface==NM_SERVICE:
+            self.manager_changed(changed)
+        elif interface==NM_DEVICE_IFACE and path in self.devices:
+            self.update_device(path, changed)
+
+    def manager_changed(self, changed):
+        if 'ActiveConnections' in changed:
+            self.refresh_active(changed['ActiveConnections'])
+
+    def fetch_device(self, path):
+        path=str(path)
+        self.call(path, dbus.PROPERTIES_IFACE, 'GetAll', (NM_DEVICE_IFACE,), lambda properties: self.update_device(path, properties))
+
+    def update_device(self, path, properties):
+        device=self.devices.setdefault(path, {'path': path, 'interface': None, 'state': None})
+        if 'Interface' in properties:
+            device['interface']=str(properties['Interface'])
+        if 'State' in properties:
+            device['state']=int(properties['State'])
+
+    def device_removed(self, path):
+        self.devices.pop(str(path), None)
+
+    def device_state_changed(self, new_state, old_state, reason, path=None):
+        if path in self.devices:
+            self.devices[path]['state']=int(new_state)
+
+    def owner_changed(self, owner):
+        if owner:
+            self.load()
+
+    def drain(self):
+        # let queued signals, and the fetches they started, update the index
+        # before a request is answered
+        context=GLib.MainContext.default()
+        while context.pending() or self.fetching > 0:
+            context.iteration(self.fetching > 0)
+
+    def handle(self, request):
+        self.drain()
+        op=request.get('op')
+        if op=='ping':
+            return {'connections': len(self.records), 'devices': len(self.devices)}
+        if op=='exists':
+            return {'exists': self.find_connection(request['name']) is not None}
+        if op=='show':
+            if request.get('name') is None:
+                return {'connections': [con.as_dict() for con in self.records.values()]}
+            con=self.find_connection(request['name'])
+            return {'connections': con is not None and [con.as_dict(with_settings=True)] or []}
+        if op=='devices':
+            return {'devices': self.devices.values()}
+        if op in ('plan', 'apply'):
+            params=request['params']
+            retry_count=self.client.retry_count
+            response={'exists': self.find_connection(params['cname']) is not None}
+            response['operations']=plan_changes(params, self, self.client.get_capabilities())
+            response['rc'], response['out'], response['err']=None, '', ''
+            if op=='apply' and response['operations']:
+                # the same host lock as the module's, against other writers
+                lock=HostLock(self.lock_file, timeout=params.get('lock_timeout'))
+                response['lock_wait']=lock.acquire()
+                try:
+                    self.drain()
+                    response['exists']=self.find_connection(params['cname']) is not None
+                    response['operations']=plan_changes(params, self, self.client.get_capabilities())
+                    if response['operations']:
+                        response['rc'], response['out'], response['err']=apply_changes(self.client, response['operations'])
+                finally:
+                    lock.release()
+            response['retries']=self.client.retry_count - retry_count
+            response['profile_count']=len(self.records)
+            return response
+        raise NmcliError('Unknown agent request %s' % op)
+
+    def accept(self, fd, condition, server):
+        conn, address=server.accept()
+        try:
+            conn.settimeout(10)
+            response=self.handle(json.loads(conn.makefile('r').readline()))
+        except Exception, e:
+            response={'error': str(e)}
+        try:
+            conn.settimeout(None)
+            conn.sendall(json.dumps(response) + '\n')
+        except socket.error:
+            pass
+        conn.close()
+        return True
+
+    def serve(self):
+        self.load()
+        self.watch()
+        directory=os.path.dirname(self.socket_path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory, 0700)
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        server=socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(self.socket_path)
+        os.chmod(self.socket_path, 0600)
+        server.listen(16)
+        GLib.io_add_watch(server.fileno(), GLib.IO_IN, self.accept, server)
+        GLib.MainLoop().run()
+
+
+def agent_request(socket_path, request):
+    # One request to a running agent, or None when there is no agent to ask
+    if not socket_path or not os.path.exists(socket_path):
+        return None
+    try:
+        conn=socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        conn.connect(socket_path)
+        conn.sendall(json.dumps(request) + '\n')
+        response=conn.makefile('r').readline()
+        conn.close()
+    except socket.error:
+        return None
+    if not response:
+        return None
+    return json.loads(response)
 
 
 class Nmcli(object):
     """
     This is the generic nmcli manipulation class that is subclassed based on platform.
+    It adapts an AnsibleModule to NmcliClient, plan_changes() and apply_changes().
     A subclass may wish to override the following action methods:-
             - create_connection()
-            - delete_connection()
+            - remove_connection()
             - modify_connection()
-            - show_connection()
             - up_connection()
             - down_connection()
     All subclasses MUST define platform and distribution (which may be None).
@@ -407,7 +2837,6 @@ class Nmcli(object):
 
     platform='Generic'
     distribution=None
-    bus=dbus.SystemBus()
     # The following is going to be used in dbus code
     DEVTYPES={1: "Ethernet",
                    2: "Wi-Fi",
@@ -441,7 +2870,7 @@ class Nmcli(object):
     def __new__(cls, *args, **kwargs):
         return load_platform_subclass(Nmcli, args, kwargs)
 
-    def __init__(self, module):
+    def __init__(self, module, client=None):
         self.module=module
         self.state=module.params['state']
         self.enabled=module.params['enabled']
@@ -477,504 +2906,412 @@ class Nmcli(object):
         self.flags=module.params['flags']
         self.ingress=module.params['ingress']
         self.egress=module.params['egress']
+        self.client=client or NmcliClient(read_backend=module.params['read_backend'],
+                                          inflight=module.params['dbus_inflight'],
+                                          files_root=module.params['files_root'],
+                                          cache_dir=module.params['cache_dir'],
+                                          nmcli_path=module.get_bin_path('nmcli') or 'nmcli',
+                                          run_command=self.run_command,
+                                          retries=module.params['retries'],
+                                          retry_delay=module.params['retry_delay'])
+        # the retries made before this run, see retries()
+        self.retry_base=self.client.retry_count
         # select whether we dump additional debug info through syslog
         self.syslogging=True
 
-    def execute_command(self, cmd, use_unsafe_shell=False, data=None):
+    def run_command(self, cmd, data=None):
         if self.syslogging:
             syslog.openlog('ansible-%s' % os.path.basename(__file__))
             syslog.syslog(syslog.LOG_NOTICE, 'Command %s' % '|'.join(cmd))
+        return self.module.run_command(cmd, data=data, environ_update=NMCLI_ENVIRON)
 
-        return self.module.run_command(cmd, use_unsafe_shell=use_unsafe_shell, data=data)
+    def execute_command(self, cmd, use_unsafe_shell=False, data=None):
+        return self.client.execute_command(cmd, data=data)
 
-    def merge_secrets(self, proxy, config, setting_name):
-        try:
-            # returns a dict of dicts mapping name::setting, where setting is a dict
-            # mapping key::value.  Each member of the 'setting' dict is a secret
-            secrets=proxy.GetSecrets(setting_name)
-
-            # Copy the secrets into our connection config
-            for setting in secrets:
-                for key in secrets[setting]:
-                    config[setting_name][key]=secrets[setting][key]
-        except Exception, e:
-            pass
+    def retries(self):
+        # the retries this run made, whichever way it ends
+        return self.client.retry_count - self.retry_base
 
-    def dict_to_string(self, d):
-        # Try to trivially translate a dictionary's elements into nice string
-        # formatting.
-        dstr=""
-        for key in d:
-            val=d[key]
-            str_val=""
-            add_string=True
-            if type(val)==type(dbus.Array([])):
-                for elt in val:
-                    if type(elt)==type(dbus.Byte(1)):
-                        str_val+="%s " % int(elt)
-                    elif type(elt)==type(dbus.String("")):
-                        str_val+="%s" % elt
-            elif type(val)==type(dbus.Dictionary({})):
-                dstr+=self.dict_to_string(val)
-                add_string=False
-            else:
-                str_val=val
-            if add_string:
-                dstr+="%s: %s\n" % ( key, str_val)
-        return dstr
-
-    def connection_to_string(self, config):
-        # dump a connection configuration to use in list_connection_info
-        setting_list=[]
-        for setting_name in config:
-            setting_list.append(self.dict_to_string(config[setting_name]))
-        return setting_list
-        # print ""
+    def fail_json(self, **kwargs):
+        kwargs.setdefault('retries', self.retries())
+        self.module.fail_json(**kwargs)
 
-    def list_connection_info(self):
-        # Ask the settings service for the list of connections it provides
-        bus=dbus.SystemBus()
+    def get_connections(self):
+        try:
+            return self.client.get_connections()
+        except NmcliError, e:
+            self.fail_json(name=self.cname, msg=str(e))
 
-        service_name="org.freedesktop.NetworkManager"
-        proxy=bus.get_object(service_name, "/org/freedesktop/NetworkManager/Settings")
-        settings=dbus.Interface(proxy, "org.freedesktop.NetworkManager.Settings")
-        connection_paths=settings.ListConnections()
-        connection_list=[]
-        # List each connection's name, UUID, and type
-        for path in connection_paths:
-            con_proxy=bus.get_object(service_name, path)
-            settings_connection=dbus.Interface(con_proxy, "org.freedesktop.NetworkManager.Settings.Connection")
-            config=settings_connection.GetSettings()
-
-            # Now get secrets too; we grab the secrets for each type of connection
-            # (since there isn't a "get all secrets" call because most of the time
-            # you only need 'wifi' secrets or '802.1x' secrets, not everything) and
-            # merge that into the configuration data - To use at a later stage
-            self.merge_secrets(settings_connection, config, '802-11-wireless')
-            self.merge_secrets(settings_connection, config, '802-11-wireless-security')
-            self.merge_secrets(settings_connection, config, '802-1x')
-            self.merge_secrets(settings_connection, config, 'gsm')
-            self.merge_secrets(settings_connection, config, 'cdma')
-            self.merge_secrets(settings_connection, config, 'ppp')
-
-            # Get the details of the 'connection' setting
-            s_con=config['connection']
-            connection_list.append(s_con['id'])
-            connection_list.append(s_con['uuid'])
-            connection_list.append(s_con['type'])
-            connection_list.append(self.connection_to_string(config))
-        return connection_list
+    def find_connection(self, name=None):
+        self.get_connections()
+        return self.client.find_connection(name or self.cname)
 
     def connection_exists(self):
-        # we are going to use name and type in this instance to find if that connection exists and is of type x
-        connections=self.list_connection_info()
+        # a profile exists when its name or UUID matches cname; the type is not an identifier
+        return self.find_connection() is not None
+
+    def plan(self):
+        try:
+            # the files backend doesn't wake NetworkManager for a probe
+            capabilities=self.client.get_capabilities(probe=self.client.read_backend!='files')
+            return plan_changes(self.module.params, self.client, capabilities)
+        except NmcliError, e:
+            self.fail_json(name=self.cname, msg=str(e))
 
-        for con_item in connections:
-            if self.cname==con_item:
-                return True
+    def apply(self, operations):
+        return apply_changes(self.client, operations)
 
     def down_connection(self):
-        cmd=[self.module.get_bin_path('nmcli', True)]
-        # if self.connection_exists():
-        cmd.append('con')
-        cmd.append('down')
-        cmd.append(self.cname)
-        return self.execute_command(cmd)
+        return self.apply([operation('down', self.cname, ['con', 'down', self.cname])])
 
     def up_connection(self):
-        cmd=[self.module.get_bin_path('nmcli', True)]
-        cmd.append('con')
-        cmd.append('up')
-        cmd.append(self.cname)
-        return self.execute_command(cmd)
-
-    def create_connection_team(self):
-        cmd=[self.module.get_bin_path('nmcli', True)]
-        # format for creating team interface
-        cmd.append('con')
-        cmd.append('add')
-        cmd.append('type')
-        cmd.append('team')
-        cmd.append('con-name')
-        if self.cname is not None:
-            cmd.append(self.cname)
-        elif self.ifname is not None:
-            cmd.append(self.ifname)
-        cmd.append('ifname')
-        if self.ifname is not None:
-            cmd.append(self.ifname)
-        elif self.cname is not None:
-            cmd.append(self.cname)
-        if self.ip4 is not None:
-            cmd.append('ip4')
-            cmd.append(self.ip4)
-        if self.gw4 is not None:
-            cmd.append('gw4')
-            cmd.append(self.gw4)
-        if self.ip6 is not None:
-            cmd.append('ip6')
-            cmd.append(self.ip6)
-        if self.gw6 is not None:
-            cmd.append('gw6')
-            cmd.append(self.gw6)
-        if self.enabled is not None:
-            cmd.append('autoconnect')
-            cmd.append(self.enabled)
-        return cmd
-
-    def modify_connection_team(self):
-        cmd=[self.module.get_bin_path('nmcli', True)]
-        # format for modifying team interface
-        cmd.append('con')
-        cmd.append('mod')
-        cmd.append(self.cname)
-        if self.ip4 is not None:
-            cmd.append('ipv4.address')
-            cmd.append(self.ip4)
-        if self.gw4 is not None:
-            cmd.append('ipv4.gateway')
-            cmd.append(self.gw4)
-        if self.dns4 is not None:
-            cmd.append('ipv4.dns')
-            cmd.append(self.dns4)
-        if self.ip6 is not None:
-            cmd.append('ipv6.address')
-            cmd.append(self.ip6)
-        if self.gw6 is not None:
-            cmd.append('ipv6.gateway')
-            cmd.append(self.gw4)
-        if self.dns6 is not None:
-            cmd.append('ipv6.dns')
-            cmd.append(self.dns6)
-        if self.enabled is not None:
-            cmd.append('autoconnect')
-            cmd.append(self.enabled)
-            # Can't use MTU with team
-        return cmd
-
-    def create_connection_team_slave(self):
-        cmd=[self.module.get_bin_path('nmcli', True)]
-        # format for creating team-slave interface
-        cmd.append('connection')
-        cmd.append('add')
-        cmd.append('type')
-        cmd.append(self.type)
-        cmd.append('con-name')
-        if self.cname is not None:
-            cmd.append(self.cname)
-        elif self.ifname is not None:
-            cmd.append(self.ifname)
-        cmd.append('ifname')
-        if self.ifname is not None:
-            cmd.append(self.ifname)
-        elif self.cname is not None:
-            cmd.append(self.cname)
-        cmd.append('master')
-        if self.cname is not None:
-            cmd.append(self.master)
-        # if self.mtu is not None:
-        #     cmd.append('802-3-ethernet.mtu')
-        #     cmd.append(self.mtu)
-        return cmd
-
-    def modify_connection_team_slave(self):
-        cmd=[self.module.get_bin_path('nmcli', True)]
-        # format for modifying team-slave interface
-        cmd.append('con')
-        cmd.append('mod')
-        cmd.append(self.cname)
-        cmd.append('connection.master')
-        cmd.append(self.master)
-        if self.mtu is not None:
-            cmd.append('802-3-ethernet.mtu')
-            cmd.append(self.mtu)
-        return cmd
-
-    def create_connection_bond(self):
-        cmd=[self.module.get_bin_path('nmcli', True)]
-        # format for creating bond interface
-        cmd.append('con')
-        cmd.append('add')
-        cmd.append('type')
-        cmd.append('bond')
-        cmd.append('con-name')
-        if self.cname is not None:
-            cmd.append(self.cname)
-        elif self.ifname is not None:
-            cmd.append(self.ifname)
-        cmd.append('ifname')
-        if self.ifname is not None:
-            cmd.append(self.ifname)
-        elif self.cname is not None:
-            cmd.append(self.cname)
-        if self.ip4 is not None:
-            cmd.append('ip4')
-            cmd.append(self.ip4)
-        if self.gw4 is not None:
-            cmd.append('gw4')
-            cmd.append(self.gw4)
-        if self.ip6 is not None:
-            cmd.append('ip6')
-            cmd.append(self.ip6)
-        if self.gw6 is not None:
-            cmd.append('gw6')
-            cmd.append(self.gw6)
-        if self.enabled is not None:
-            cmd.append('autoconnect')
-            cmd.append(self.enabled)
-        if self.mode is not None:
-            cmd.append('mode')
-            cmd.append(self.mode)
-        if self.miimon is not None:
-            cmd.append('miimon')
-            cmd.append(self.miimon)
-        if self.downdelay is not None:
-            cmd.append('downdelay')
-            cmd.append(self.downdelay)
-        if self.downdelay is not None:
-            cmd.append('updelay')
-            cmd.append(self.updelay)
-        if self.downdelay is not None:
-            cmd.append('arp-interval')
-            cmd.append(self.arp_interval)
-        if self.downdelay is not None:
-            cmd.append('arp-ip-target')
-            cmd.append(self.arp_ip_target)
-        return cmd
-
-    def modify_connection_bond(self):
-        cmd=[self.module.get_bin_path('nmcli', True)]
-        # format for modifying bond interface
-        cmd.append('con')
-        cmd.append('mod')
-        cmd.append(self.cname)
-        if self.ip4 is not None:
-            cmd.append('ipv4.address')
-            cmd.append(self.ip4)
-        if self.gw4 is not None:
-            cmd.append('ipv4.gateway')
-            cmd.append(self.gw4)
-        if self.dns4 is not None:
-            cmd.append('ipv4.dns')
-            cmd.append(self.dns4)
-        if self.ip6 is not None:
-            cmd.append('ipv6.address')
-            cmd.append(self.ip6)
-        if self.gw6 is not None:
-            cmd.append('ipv6.gateway')
-            cmd.append(self.gw4)
-        if self.dns6 is not None:
-            cmd.append('ipv6.dns')
-            cmd.append(self.dns6)
-        if self.enabled is not None:
-            cmd.append('autoconnect')
-            cmd.append(self.enabled)
-        return cmd
-
-    def create_connection_bond_slave(self):
-        cmd=[self.module.get_bin_path('nmcli', True)]
-        # format for creating bond-slave interface
-        cmd.append('connection')
-        cmd.append('add')
-        cmd.append('type')
-        cmd.append('bond-slave')
-        cmd.append('con-name')
-        if self.cname is not None:
-            cmd.append(self.cname)
-        elif self.ifname is not None:
-            cmd.append(self.ifname)
-        cmd.append('ifname')
-        if self.ifname is not None:
-            cmd.append(self.ifname)
-        elif self.cname is not None:
-            cmd.append(self.cname)
-        cmd.append('master')
-        if self.cname is not None:
-            cmd.append(self.master)
-        return cmd
-
-    def modify_connection_bond_slave(self):
-        cmd=[self.module.get_bin_path('nmcli', True)]
-        # format for modifying bond-slave interface
-        cmd.append('con')
-        cmd.append('mod')
-        cmd.append(self.cname)
-        cmd.append('connection.master')
-        cmd.append(self.master)
-        return cmd
-
-    def create_connection_ethernet(self):
-        cmd=[self.module.get_bin_path('nmcli', True)]
-        # format for creating ethernet interface
-        # To add an Ethernet connection with static IP configuration, issue a command as follows
-        # - nmcli: name=add cname=my-eth1 ifname=eth1 type=ethernet ip4=192.168.100.100/24 gw4=192.168.100.1 state=present
-        # nmcli con add con-name my-eth1 ifname eth1 type ethernet ip4 192.168.100.100/24 gw4 192.168.100.1
-        cmd.append('con')
-        cmd.append('add')
-        cmd.append('type')
-        cmd.append('ethernet')
-        cmd.append('con-name')
-        if self.cname is not None:
-            cmd.append(self.cname)
-        elif self.ifname is not None:
-            cmd.append(self.ifname)
-        cmd.append('ifname')
-        if self.ifname is not None:
-            cmd.append(self.ifname)
-        elif self.cname is not None:
-            cmd.append(self.cname)
-        if self.ip4 is not None:
-            cmd.append('ip4')
-            cmd.append(self.ip4)
-        if self.gw4 is not None:
-            cmd.append('gw4')
-            cmd.append(self.gw4)
-        if self.ip6 is not None:
-            cmd.append('ip6')
-            cmd.append(self.ip6)
-        if self.gw6 is not None:
-            cmd.append('gw6')
-            cmd.append(self.gw6)
-        if self.enabled is not None:
-            cmd.append('autoconnect')
-            cmd.append(self.enabled)
-        return cmd
-
-    def modify_connection_ethernet(self):
-        cmd=[self.module.get_bin_path('nmcli', True)]
-        # format for  modifying ethernet interface
-        # To add an Ethernet connection with static IP configuration, issue a command as follows
-        # - nmcli: name=add cname=my-eth1 ifname=eth1 type=ethernet ip4=192.168.100.100/24 gw4=192.168.100.1 state=present
-        # nmcli con add con-name my-eth1 ifname eth1 type ethernet ip4 192.168.100.100/24 gw4 192.168.100.1
-        cmd.append('con')
-        cmd.append('mod')
-        cmd.append(self.cname)
-        if self.ip4 is not None:
-            cmd.append('ipv4.address')
-            cmd.append(self.ip4)
-        if self.gw4 is not None:
-            cmd.append('ipv4.gateway')
-            cmd.append(self.gw4)
-        if self.dns4 is not None:
-            cmd.append('ipv4.dns')
-            cmd.append(self.dns4)
-        if self.ip6 is not None:
-            cmd.append('ipv6.address')
-            cmd.append(self.ip6)
-        if self.gw6 is not None:
-            cmd.append('ipv6.gateway')
-            cmd.append(self.gw4)
-        if self.dns6 is not None:
-            cmd.append('ipv6.dns')
-            cmd.append(self.dns6)
-        if self.mtu is not None:
-            cmd.append('802-3-ethernet.mtu')
-            cmd.append(self.mtu)
-        if self.enabled is not None:
-            cmd.append('autoconnect')
-            cmd.append(self.enabled)
-        return cmd
-
-    def create_connection_bridge(self):
-        cmd=[self.module.get_bin_path('nmcli', True)]
-        # format for creating bridge interface
-        return cmd
-
-    def modify_connection_bridge(self):
-        cmd=[self.module.get_bin_path('nmcli', True)]
-        # format for modifying bridge interface
-        return cmd
-
-    def create_connection_vlan(self):
-        cmd=[self.module.get_bin_path('nmcli', True)]
-        # format for creating ethernet interface
-        return cmd
-
-    def modify_connection_vlan(self):
-        cmd=[self.module.get_bin_path('nmcli', True)]
-        # format for modifying ethernet interface
-        return cmd
+        return self.apply([operation('up', self.cname, ['con', 'up', self.cname])])
 
     def create_connection(self):
-        cmd=[]
-        if self.type=='team':
-            # cmd=self.create_connection_team()
-            if (self.dns4 is not None) or (self.dns6 is not None):
-                cmd=self.create_connection_team()
-                self.execute_command(cmd)
-                cmd=self.modify_connection_team()
-                self.execute_command(cmd)
-                cmd=self.up_connection()
-                return self.execute_command(cmd)
-            elif (self.dns4 is None) or (self.dns6 is None):
-                cmd=self.create_connection_team()
-                return self.execute_command(cmd)
-        elif self.type=='team-slave':
-            if self.mtu is not None:
-                cmd=self.create_connection_team_slave()
-                self.execute_command(cmd)
-                cmd=self.modify_connection_team_slave()
-                self.execute_command(cmd)
-                # cmd=self.up_connection()
-                return self.execute_command(cmd)
-            else:
-                cmd=self.create_connection_team_slave()
-                return self.execute_command(cmd)
-        elif self.type=='bond':
-            if (self.mtu is not None) or (self.dns4 is not None) or (self.dns6 is not None):
-                cmd=self.create_connection_bond()
-                self.execute_command(cmd)
-                cmd=self.modify_connection_bond()
-                self.execute_command(cmd)
-                cmd=self.up_connection()
-                return self.execute_command(cmd)
-            else:
-                cmd=self.create_connection_bond()
-                return self.execute_command(cmd)
-        elif self.type=='bond-slave':
-            cmd=self.create_connection_bond_slave()
-        elif self.type=='ethernet':
-            if (self.mtu is not None) or (self.dns4 is not None) or (self.dns6 is not None):
-                cmd=self.create_connection_ethernet()
-                self.execute_command(cmd)
-                cmd=self.modify_connection_ethernet()
-                self.execute_command(cmd)
-                cmd=self.up_connection()
-                return self.execute_command(cmd)
-            else:
-                cmd=self.create_connection_ethernet()
-                return self.execute_command(cmd)
-        elif self.type=='bridge':
-            cmd=self.create_connection_bridge()
-        elif self.type=='vlan':
-            cmd=self.create_connection_vlan()
-        return self.execute_command(cmd)
+        return self.apply(self.plan())
 
     def remove_connection(self):
-        # self.down_connection()
-        cmd=[self.module.get_bin_path('nmcli', True)]
-        cmd.append('con')
-        cmd.append('del')
-        cmd.append(self.cname)
-        return self.execute_command(cmd)
+        return self.apply([operation('delete', self.cname, ['con', 'del', self.cname])])
 
     def modify_connection(self):
-        cmd=[]
-        if self.type=='team':
-            cmd=self.modify_connection_team()
-        elif self.type=='team-slave':
-            cmd=self.modify_connection_team_slave()
-        elif self.type=='bond':
-            cmd=self.modify_connection_bond()
-        elif self.type=='bond-slave':
-            cmd=self.modify_connection_bond_slave()
-        elif self.type=='ethernet':
-            cmd=self.modify_connection_ethernet()
-        elif self.type=='bridge':
-            cmd=self.modify_connection_bridge()
-        elif self.type=='vlan':
-            cmd=self.modify_connection_vlan()
-        return self.execute_command(cmd)
+        return self.apply(self.plan())
+
+
+def take_lock(module, nmcli, result):
+    # the host lock for writing, with how long it took in the result
+    lock=HostLock(module.params['lock_file'], timeout=module.params['lock_timeout'])
+    try:
+        result['lock_wait']=round(lock.acquire(), 3)
+    except (NmcliError, OSError, IOError), e:
+        nmcli.fail_json(name=nmcli.cname, msg=str(e))
+    return lock
+
+
+def run_module(module, nmcli):
+    # The module's work, returning its result; failures exit through fail_json
+    result={}
+    result['cname']=nmcli.cname
+    result['state']=nmcli.state
+
+    # show is read only; settings are only decoded for the profile asked for
+    if nmcli.action=='show':
+        response=agent_request(module.params['agent_socket'], {'op': 'show', 'name': nmcli.cname})
+        if response is not None and 'error' not in response:
+            if not response['connections']:
+                nmcli.fail_json(msg='No Connection named %s exists' % nmcli.cname)
+            result.update(response, changed=False, agent=True)
+            return result
+        if nmcli.cname is None:
+            result['connections']=[con.as_dict() for con in nmcli.get_connections()]
+        else:
+            con=nmcli.find_connection()
+            if con is None:
+                nmcli.fail_json(msg='No Connection named %s exists' % nmcli.cname)
+            result['connections']=[con.as_dict(with_settings=True)]
+        result['changed']=False
+        return result
+
+    # check for issues
+    if nmcli.cname is None:
+        nmcli.fail_json(msg="You haven't specified a name for the connection")
+    # team-slave checks
+    if nmcli.type=='team-slave' and nmcli.master is None:
+        nmcli.fail_json(msg="You haven't specified a name for the master so we're not changing a thing")
+    if nmcli.type=='team-slave' and nmcli.ifname is None:
+        nmcli.fail_json(msg="You haven't specified a name for the connection")
+    # bond and team checks
+    try:
+        if nmcli.type=='bond':
+            check_bond_options(module.params)
+        if nmcli.type=='team':
+            check_team_options(module.params)
+    except NmcliError, e:
+        nmcli.fail_json(msg=str(e))
+
+    # offline rendering: keyfiles below render_root, no D-Bus and no nmcli
+    if module.params['render_root'] is not None:
+        if nmcli.state=='present' and nmcli.type is None:
+            nmcli.fail_json(msg="You haven't specified a type for the connection to render")
+        try:
+            result['changed'], result['path']=render_keyfile(module.params, module.params['render_root'], module.check_mode)
+        except NmcliError, e:
+            nmcli.fail_json(name=nmcli.cname, msg=str(e))
+        return result
+
+    # a running agent answers from its signal maintained index; saving and
+    # applying plans is left to the module itself
+    response=None
+    if module.params['plan_file'] is None and module.params['apply_plan'] is None:
+        response=agent_request(module.params['agent_socket'], {'op': module.check_mode and 'plan' or 'apply', 'params': module.params})
+    if module.params['apply_plan'] is not None:
+        # a plan an earlier run saved, run as it is once its profile checks out
+        try:
+            entry=read_plans(module.params['apply_plan']).get(nmcli.cname)
+        except (IOError, ValueError, NmcliError), e:
+            nmcli.fail_json(name=nmcli.cname, msg='Could not read the plan in %s: %s' % (module.params['apply_plan'], e))
+        if entry is None:
+            nmcli.fail_json(name=nmcli.cname, msg='%s has no plan for %s' % (module.params['apply_plan'], nmcli.cname))
+        exists=entry['uuid'] is not None
+        operations=entry['operations']
+        (rc, out, err)=(None, '', '')
+        lock=None
+        if operations and not module.check_mode:
+            lock=take_lock(module, nmcli, result)
+        error=None
+        try:
+            stale=check_plan(nmcli.client, entry)
+            if stale is not None:
+                error='%s, so the plan was not applied; plan again' % stale
+            elif lock is not None:
+                (rc, out, err)=nmcli.apply(operations)
+        except NmcliError, e:
+            error=str(e)
+        if lock is not None:
+            lock.release()
+        if error is not None:
+            nmcli.fail_json(name=nmcli.cname, msg=error)
+    elif response is not None:
+        # the agent's retries count as this run's
+        nmcli.retry_base-=response.get('retries', 0)
+        if 'error' in response:
+            nmcli.fail_json(name=nmcli.cname, msg=response['error'])
+        result['agent']=True
+        if 'lock_wait' in response:
+            result['lock_wait']=round(response['lock_wait'], 3)
+        result['profile_count']=response.get('profile_count')
+        exists=response['exists']
+        operations=response['operations']
+        (rc, out, err)=(response['rc'], response['out'], response['err'])
+    else:
+        exists=nmcli.connection_exists()
+        operations=nmcli.plan()
+        (rc, out, err)=(None, '', '')
+        if module.params['plan_file'] is not None:
+            try:
+                write_plan(module.params['plan_file'], plan_entry(module.params, nmcli.find_connection(), operations))
+            except (IOError, OSError, ValueError, NmcliError), e:
+                nmcli.fail_json(name=nmcli.cname, msg='Could not save the plan in %s: %s' % (module.params['plan_file'], e))
+            result['plan_file']=module.params['plan_file']
+        if operations and not module.check_mode:
+            # Writers queue up on the host lock; planning, check mode and runs
+            # with nothing to change never take it.  Once it is held, plan
+            # again from what NetworkManager has loaded now, since another
+            # writer may just have changed it, or the read backend answered
+            # from files.
+            lock=take_lock(module, nmcli, result)
+            try:
+                nmcli.client.verify_with_networkmanager()
+                nmcli.client.invalidate()
+                exists=nmcli.connection_exists()
+                operations=nmcli.plan()
+                if operations:
+                    (rc, out, err)=nmcli.apply(operations)
+            finally:
+                lock.release()
+
+    if nmcli.state=='present':
+        if exists:
+            result['Exists']='Connections do exist so we are modifying them'
+        else:
+            result['Connection']=('Connection %s of Type %s is being added' % (nmcli.cname, nmcli.type))
+    changes=[change for op in operations for change in op.get('changes', [])]
+    if changes:
+        result['changes']=[dict(property=prop, current=current, desired=desired) for prop, current, desired in changes]
+
+    result['changed']=bool(operations)
+    result['retries']=nmcli.retries()
+    if nmcli.client.capabilities is not None:
+        result['nm_version']=nmcli.client.capabilities['version']
+    if rc is not None and rc!=0:
+        nmcli.fail_json(name=nmcli.cname, msg=err, rc=rc)
+    if out:
+        result['stdout']=out
+    if err:
+        result['stderr']=err
+    return result
+
+
+def measured(module, nmcli):
+    # run_module() with what callback_plugins/nmcli_timing.py aggregates:
+    # the wall time and the part of it spent enumerating profiles, the D-Bus
+    # and nmcli calls made and the number of profiles on the host
+    client=nmcli.client
+    read_time, dbus_calls, nmcli_calls=client.read_time, client.dbus_calls, client.nmcli_calls
+    start=time.time()
+    result=run_module(module, nmcli)
+    result['timing']=dict(total=round(time.time() - start, 6), read=round(client.read_time - read_time, 6))
+    result['dbus_calls']=client.dbus_calls - dbus_calls
+    result['nmcli_calls']=client.nmcli_calls - nmcli_calls
+    result.setdefault('profile_count', client.profile_count)
+    return result
+
+
+class BatchItemFailed(Exception):
+    pass
+
+
+ITEM_TRUE=('yes', 'on', '1', 'true', 1, True)
+ITEM_FALSE=('no', 'off', '0', 'false', 0, False)
+
+
+def convert_item_value(value, kind):
+    # value as an argument of type kind, the way AnsibleModule converts them;
+    # ValueError if it can't be
+    if kind=='str':
+        if isinstance(value, (dict, list)):
+            raise ValueError
+        return isinstance(value, basestring) and value or str(value)
+    if kind=='int':
+        return int(value)
+    if kind=='float':
+        return float(value)
+    if kind=='bool':
+        if isinstance(value, basestring):
+            value=value.lower()
+        if value in ITEM_TRUE:
+            return True
+        if value in ITEM_FALSE:
+            return False
+        raise ValueError
+    if kind=='list':
+        if isinstance(value, list):
+            return value
+        if isinstance(value, basestring):
+            return value.split(',')
+        if isinstance(value, (int, float)):
+            return [str(value)]
+        raise ValueError
+    if kind=='dict':
+        if isinstance(value, dict):
+            return value
+        if isinstance(value, basestring) and value.startswith('{'):
+            return json.loads(value)
+        if isinstance(value, basestring):
+            return dict(item.split('=', 1) for item in shlex.split(value))
+        raise ValueError
+    return value
+
+
+def check_item(spec, params):
+    # One entry of 'connections' checked and converted against the module's
+    # argument_spec like the module's own arguments are: unknown names,
+    # types and choices.  Returns the converted entry; NmcliError if it is
+    # not valid.
+    unknown=sorted([name for name in params if name not in spec])
+    if unknown:
+        raise NmcliError('Unsupported parameters: %s' % ', '.join(unknown))
+    converted={}
+    for name, value in params.items():
+        kind=spec[name].get('type', 'str')
+        if value is not None:
+            try:
+                value=convert_item_value(value, kind)
+            except (ValueError, TypeError):
+                raise NmcliError('%s is of type %s and could not be converted to %s' % (name, type(value).__name__, kind))
+        choices=spec[name].get('choices')
+        if isinstance(params[name], bool) and choices and 'yes' in choices:
+            # YAML made a bool of yes/no
+            value=params[name] and 'yes' or 'no'
+        if value is not None and choices and value not in choices:
+            raise NmcliError('value of %s must be one of: %s, got: %s' % (name, ', '.join(choices), value))
+        converted[name]=value
+    return converted
+
+
+class BatchItem(object):
+    # Stands in for the AnsibleModule while one entry of 'connections' is
+    # run, so that fail_json() ends that entry and not the whole batch
+    def __init__(self, module, params):
+        self.module=module
+        self.params=dict(module.params, connections=None)
+        try:
+            if not isinstance(params, dict):
+                raise NmcliError('each of connections must be a dict of options')
+            self.params.update(check_item(module.argument_spec, params))
+        except NmcliError, e:
+            self.fail_json(msg=str(e))
+        if self.params['state'] is None:
+            self.fail_json(name=self.params['cname'], msg='missing required arguments: state')
+
+    def __getattr__(self, name):
+        return getattr(self.module, name)
+
+    def fail_json(self, **kwargs):
+        kwargs['failed']=True
+        raise BatchItemFailed(kwargs)
+
+
+def run_batch(module, nmcli):
+    # Run every entry of 'connections' against one client, and so one
+    # snapshot, returning a result per entry in order
+    results=[]
+    for params in module.params['connections']:
+        try:
+            item=BatchItem(module, params)
+            results.append(measured(item, Nmcli(item, client=nmcli.client)))
+        except BatchItemFailed, e:
+            results.append(e.args[0])
+    result=dict(changed=any(item.get('changed') for item in results), results=results)
+    failed=[index for index, item in enumerate(results) if item.get('failed')]
+    if failed:
+        # the whole task fails with its entries, as a loop would
+        result['failed']=True
+        result['msg']='%d of %d connections failed: %s' % (len(failed), len(results), ', '.join([str(results[index].get('name', index)) for index in failed]))
+    return result
+
+
+def run_main(module):
+    nmcli=Nmcli(module)
+
+    if nmcli.syslogging:
+        syslog.openlog('ansible-%s' % os.path.basename(__file__))
+        syslog.syslog(syslog.LOG_NOTICE, 'Nmcli instantiated - platform %s' % nmcli.platform)
+        if nmcli.distribution:
+            syslog.syslog(syslog.LOG_NOTICE, 'Nuser instantiated - distribution %s' % nmcli.distribution)
+
+    if module.params['connections'] is not None:
+        return run_batch(module, nmcli)
+    return measured(module, nmcli)
+
+
+def profile_summary(profiler, top):
+    # the top functions by cumulative time
+    stats=pstats.Stats(profiler).stats
+    rows=sorted(stats.items(), key=lambda item: item[1][3], reverse=True)[:top]
+    return [dict(function='%s:%d(%s)' % (filename, line, name), calls=calls, tottime=round(tottime, 6), cumtime=round(cumtime, 6))
+            for (filename, line, name), (primitive_calls, calls, tottime, cumtime, callers) in rows]
+
+
+def prune_profiles(directory, max_bytes):
+    # drop the oldest dumps until what is left fits in max_bytes, always
+    # keeping the newest
+    dumps=[os.path.join(directory, name) for name in os.listdir(directory) if name.endswith('.prof')]
+    dumps=sorted([(os.stat(path).st_mtime, os.stat(path).st_size, path) for path in dumps])
+    total=sum([size for mtime, size, path in dumps])
+    while len(dumps) > 1 and total > max_bytes:
+        mtime, size, path=dumps.pop(0)
+        os.unlink(path)
+        total-=size
+
+
+def profile_call(profile_dir, top, max_mb, func, *args):
+    # Run func under cProfile.  The stats are dumped below
+    # profile_dir/<host>/, even when func exits through fail_json, and the
+    # result gets the dump's path and the top hotspots as 'profile'.
+    directory=os.path.join(profile_dir, socket.gethostname())
+    path=os.path.join(directory, 'nmcli-%s-%d.prof' % (time.strftime('%Y%m%d%H%M%S'), os.getpid()))
+    profiler=cProfile.Profile()
+    profiler.enable()
+    try:
+        result=func(*args)
+    finally:
+        profiler.disable()
+        if not os.path.isdir(directory):
+            os.makedirs(directory, 0700)
+        profiler.dump_stats(path)
+        prune_profiles(directory, max_mb * 1024 * 1024)
+    result['profile']=dict(path=path, top=profile_summary(profiler, top))
+    return result
 
 
 def main():
@@ -983,27 +3320,67 @@ def main():
         argument_spec=dict(
             enabled=dict(required=False, default=None, choices=['yes', 'no'], type='str'),
             action=dict(required=False, default=None, choices=['add', 'mod', 'show', 'up', 'down', 'del'], type='str'),
-            state=dict(required=True, default=None, choices=['present', 'absent'], type='str'),
+            state=dict(required=False, default=None, choices=['present', 'absent'], type='str'),
             cname=dict(required=False, type='str'),
             master=dict(required=False, default=None, type='str'),
+            slave_type=dict(required=False, default=None, choices=['bond', 'team', 'bridge'], type='str'),
+            veth_peer=dict(required=False, default=None, type='str'),
             autoconnect=dict(required=False, default=None, choices=['yes', 'no'], type='str'),
             ifname=dict(required=False, default=None, type='str'),
-            type=dict(required=False, default=None, choices=['ethernet', 'team', 'team-slave', 'bond', 'bond-slave', 'bridge', 'vlan'], type='str'),
+            type=dict(required=False, default=None, choices=['ethernet', 'team', 'team-slave', 'bond', 'bond-slave', 'bridge', 'vlan', 'dummy', 'veth'], type='str'),
             ip4=dict(required=False, default=None, type='str'),
             gw4=dict(required=False, default=None, type='str'),
-            dns4=dict(required=False, default=None, type='str'),
+            dns4=dict(required=False, default=None, type='list'),
             ip6=dict(required=False, default=None, type='str'),
             gw6=dict(required=False, default=None, type='str'),
-            dns6=dict(required=False, default=None, type='str'),
+            dns6=dict(required=False, default=None, type='list'),
+            dns4_search=dict(required=False, default=None, type='list'),
+            dns6_search=dict(required=False, default=None, type='list'),
+            dns4_options=dict(required=False, default=None, type='list'),
+            dns6_options=dict(required=False, default=None, type='list'),
+            dns4_priority=dict(required=False, default=None, type='int'),
+            dns6_priority=dict(required=False, default=None, type='int'),
             # Bond Specific vars
-            mode=dict(require=False, default="balance-rr", choices=["balance-rr", "active-backup", "balance-xor", "broadcast", "802.3ad", "balance-tlb", "balance-alb"], type='str'),
+            mode=dict(required=False, default=None, choices=["balance-rr", "active-backup", "balance-xor", "broadcast", "802.3ad", "balance-tlb", "balance-alb"], type='str'),
             miimon=dict(required=False, default=None, type='str'),
             downdelay=dict(required=False, default=None, type='str'),
             updelay=dict(required=False, default=None, type='str'),
             arp_interval=dict(required=False, default=None, type='str'),
             arp_ip_target=dict(required=False, default=None, type='str'),
+            primary=dict(required=False, default=None, type='str'),
+            xmit_hash_policy=dict(required=False, default=None, choices=['layer2', 'layer2+3', 'layer3+4', 'encap2+3', 'encap3+4'], type='str'),
+            lacp_rate=dict(required=False, default=None, choices=['slow', 'fast'], type='str'),
+            ad_select=dict(required=False, default=None, choices=['stable', 'bandwidth', 'count'], type='str'),
+            all_slaves_active=dict(required=False, default=None, type='bool'),
+            # team specific vars
+            runner=dict(required=False, default=None, choices=['roundrobin', 'activebackup', 'loadbalance', 'broadcast', 'random', 'lacp'], type='str'),
+            runner_tx_hash=dict(required=False, default=None, type='list'),
+            runner_tx_balancer_interval=dict(required=False, default=None, type='int'),
+            link_watch=dict(required=False, default=None, choices=['ethtool', 'arp_ping', 'nsna_ping'], type='str'),
+            team_port_priority=dict(required=False, default=None, type='int'),
             # general usage
             mtu=dict(required=False, default=None, type='str'),
+            ethtool_features=dict(required=False, default=None, type='dict'),
+            ethtool_ring=dict(required=False, default=None, type='dict'),
+            ethtool_coalesce=dict(required=False, default=None, type='dict'),
+            tc_qdiscs=dict(required=False, default=None, type='list'),
+            tc_tfilters=dict(required=False, default=None, type='list'),
+            route_metric4=dict(required=False, default=None, type='int'),
+            route_metric6=dict(required=False, default=None, type='int'),
+            autoconnect_slaves=dict(required=False, default=None, type='bool'),
+            autoconnect_priority=dict(required=False, default=None, type='int'),
+            autoconnect_retries=dict(required=False, default=None, type='int'),
+            wait_device_timeout=dict(required=False, default=None, type='int'),
+            method4=dict(required=False, default=None, choices=['auto', 'manual', 'link-local', 'shared', 'disabled'], type='str'),
+            method6=dict(required=False, default=None, choices=['auto', 'dhcp', 'manual', 'link-local', 'shared', 'ignore', 'disabled'], type='str'),
+            dhcp_timeout4=dict(required=False, default=None, type='int'),
+            dhcp_timeout6=dict(required=False, default=None, type='int'),
+            may_fail4=dict(required=False, default=None, type='bool'),
+            may_fail6=dict(required=False, default=None, type='bool'),
+            dad_timeout4=dict(required=False, default=None, type='int'),
+            addr_gen_mode6=dict(required=False, default=None, choices=['eui64', 'stable-privacy', 'default-or-eui64', 'default'], type='str'),
+            required_timeout4=dict(required=False, default=None, type='int'),
+            required_timeout6=dict(required=False, default=None, type='int'),
             mac=dict(required=False, default=None, type='str'),
             # bridge specific vars
             stp=dict(required=False, default='yes', choices=['yes', 'no'], type='str'),
@@ -1019,71 +3396,50 @@ def main():
             flags=dict(required=False, default=None, type='str'),
             ingress=dict(required=False, default=None, type='str'),
             egress=dict(required=False, default=None, type='str'),
+            # D-Bus enumeration
+            dbus_inflight=dict(required=False, default=32, type='int'),
+            read_backend=dict(required=False, default='auto', choices=['auto', 'dbus', 'nmcli', 'files'], type='str'),
+            write_method=dict(required=False, default='mod', choices=['mod', 'edit'], type='str'),
+            files_root=dict(required=False, default='/', type='str'),
+            cache_dir=dict(required=False, default='/var/cache/ansible-nmcli', type='str'),
+            # offline rendering
+            render_root=dict(required=False, default=None, type='str'),
+            # reconciler agent
+            agent_socket=dict(required=False, default=AGENT_SOCKET, type='str'),
+            # retrying what NetworkManager was too busy for
+            retries=dict(required=False, default=3, type='int'),
+            retry_delay=dict(required=False, default=1.0, type='float'),
+            # serializing writers on the host
+            lock_file=dict(required=False, default=LOCK_FILE, type='str'),
+            lock_timeout=dict(required=False, default=300, type='int'),
+            # profiling a run
+            profile_dir=dict(required=False, default=None, type='str'),
+            profile_top=dict(required=False, default=15, type='int'),
+            profile_max_mb=dict(required=False, default=50, type='int'),
+            # planning in one run and applying in another
+            plan_file=dict(required=False, default=None, type='str'),
+            apply_plan=dict(required=False, default=None, type='str'),
+            # many connections in one run, see action_plugins/nmcli.py
+            connections=dict(required=False, default=None, type='list'),
         ),
+        # state, or a state in each of connections (see check_item())
+        required_one_of=[['state', 'connections']],
         supports_check_mode=True
     )
 
-    nmcli=Nmcli(module)
 
-    if nmcli.syslogging:
-        syslog.openlog('ansible-%s' % os.path.basename(__file__))
-        syslog.syslog(syslog.LOG_NOTICE, 'Nmcli instantiated - platform %s' % nmcli.platform)
-        if nmcli.distribution:
-            syslog.syslog(syslog.LOG_NOTICE, 'Nuser instantiated - distribution %s' % nmcli.distribution)
-
-    rc=None
-    out=''
-    err=''
-    result={}
-    result['cname']=nmcli.cname
-    result['state']=nmcli.state
-
-    # check for issues
-    if nmcli.cname is None:
-        nmcli.module.fail_json(msg="You haven't specified a name for the connection")
-    # team-slave checks
-    if nmcli.type=='team-slave' and nmcli.master is None:
-        nmcli.module.fail_json(msg="You haven't specified a name for the master so we're not changing a thing")
-    if nmcli.type=='team-slave' and nmcli.ifname is None:
-        nmcli.module.fail_json(msg="You haven't specified a name for the connection")
-
-    if nmcli.state=='absent':
-        if nmcli.connection_exists():
-            if module.check_mode:
-                module.exit_json(changed=True)
-            (rc, out, err)=nmcli.down_connection()
-            (rc, out, err)=nmcli.remove_connection()
-        if rc!=0:
-            module.fail_json(name =('No Connection named %s exists' % nmcli.cname), msg=err, rc=rc)
-
-    elif nmcli.state=='present':
-        if nmcli.connection_exists():
-            # modify connection (note: this function is check mode aware)
-            # result['Connection']=('Connection %s of Type %s is not being added' % (nmcli.cname, nmcli.type))
-            result['Exists']='Connections do exist so we are modifying them'
-            if module.check_mode:
-                module.exit_json(changed=True)
-            (rc, out, err)=nmcli.modify_connection()
-        if not nmcli.connection_exists():
-            result['Connection']=('Connection %s of Type %s is being added' % (nmcli.cname, nmcli.type))
-            if module.check_mode:
-                module.exit_json(changed=True)
-            (rc, out, err)=nmcli.create_connection()
-        if rc is not None and rc!=0:
-            module.fail_json(name=nmcli.cname, msg=err, rc=rc)
-
-    if rc is None:
-        result['changed']=False
+    profile_dir=module.params['profile_dir'] or os.environ.get('NMCLI_PROFILE_DIR')
+    if profile_dir:
+        result=profile_call(profile_dir, module.params['profile_top'], module.params['profile_max_mb'], run_main, module)
     else:
-        result['changed']=True
-    if out:
-        result['stdout']=out
-    if err:
-        result['stderr']=err
-
+        result=run_main(module)
     module.exit_json(**result)
 
 # import module snippets
 from ansible.module_utils.basic import *
 
-main()
\ No newline at end of file
+if __name__ == '__main__':
+    if sys.argv[1:2]==['--agent']:
+        NmcliAgent(*sys.argv[2:3]).serve()
+    else:
+        main()
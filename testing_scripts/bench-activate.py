@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+#
+# End to end activation benchmark for the nmcli module.  Run as root, it
+# re-runs itself in a new network and mount namespace with a private system
+# bus and NetworkManager (keyfile plugin, state on tmpfs) over veth links,
+# so nothing on the host is touched and no hardware is needed.  Each scenario
+# is created through the module's own main(), as Ansible would run it, once
+# per read backend, and timed until its first profile is activated; then it
+# is removed again.  Per round it records the time to activated, the time
+# spent in the module, the nmcli and D-Bus calls the module made and the CPU
+# time NetworkManager used.
+#
+# Needs unshare(1), ip(8), dbus-daemon, NetworkManager and Ansible 2.1 or
+# later; team scenarios need teamd.  The 'dbus' backend is skipped where
+# python-dbus isn't installed.
+#
+# usage: python bench-activate.py [rounds] [report.json] [backend ...]
+
+import imp
+import json
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from distutils.spawn import find_executable
+from StringIO import StringIO
+
+if os.geteuid() != 0:
+    sys.exit("bench-activate.py needs root for its namespace")
+if os.environ.get('NMCLI_BENCH_NS') is None:
+    os.environ['NMCLI_BENCH_NS'] = '1'
+    os.execvp('unshare', ['unshare', '--net', '--mount', '--propagation', 'private', sys.executable, os.path.abspath(__file__)] + sys.argv[1:])
+
+from ansible.module_utils import basic
+
+nmcli = imp.load_source('nmcli', os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'library', 'nmcli.py'))
+
+rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+report_path = sys.argv[2] if len(sys.argv) > 2 else 'bench-activate.json'
+backends = sys.argv[3:] or ['dbus', 'nmcli']
+if not nmcli.HAS_DBUS and 'dbus' in backends:
+    print "python-dbus is not installed, skipping the dbus backend"
+    backends.remove('dbus')
+
+BUS_ADDRESS = 'unix:path=/run/dbus/system_bus_socket'
+# veth pairs: the first end is NetworkManager's, the peer is kept up for carrier
+LINKS = ['bv0', 'bv1', 'bv2']
+ACTIVATE_TIMEOUT = 60
+NM_CONF = """[main]
+plugins=keyfile
+no-auto-default=*
+auth-polkit=false
+dhcp=internal
+
+[logging]
+level=ERR
+"""
+
+
+def bond(mode):
+    return [dict(cname='bench-bond', ifname='bbond0', type='bond', mode=mode, ip4='192.0.2.1/24'),
+            dict(cname='bench-bond-bv1', ifname='bv1', type='bond-slave', master='bench-bond'),
+            dict(cname='bench-bond-bv2', ifname='bv2', type='bond-slave', master='bench-bond')]
+
+# name -> the profiles to create, the first one being waited for
+SCENARIOS = [('ethernet', [dict(cname='bench-eth', ifname='bv0', type='ethernet', ip4='192.0.2.1/24')]),
+             ('dummy', [dict(cname='bench-dummy', ifname='bd0', type='dummy', ip4='192.0.2.1/24')]),
+             ('veth', [dict(cname='bench-veth', ifname='bx0', type='veth', veth_peer='bx1', ip4='192.0.2.1/24')])]
+SCENARIOS += [('bond-%s' % mode, bond(mode)) for mode in ('balance-rr', 'active-backup', 'balance-xor', 'broadcast', '802.3ad', 'balance-tlb', 'balance-alb')]
+SCENARIOS += [('team', [dict(cname='bench-team', ifname='bteam0', type='team', ip4='192.0.2.1/24'),
+                        dict(cname='bench-team-bv1', ifname='bv1', type='team-slave', master='bench-team'),
+                        dict(cname='bench-team-bv2', ifname='bv2', type='team-slave', master='bench-team')]),
+              ('bridge', [dict(cname='bench-br', ifname='bbr0', type='bridge', ip4='192.0.2.1/24')]),
+              ('vlan-on-bond', bond('active-backup') + [dict(cname='bench-vlan', ifname='bbond0.10', type='vlan', vlandev='bbond0', vlanid=10, ip4='198.51.100.1/24')])]
+# the vlan is the one waited for
+SCENARIOS[-1][1].insert(0, SCENARIOS[-1][1].pop())
+
+
+def run(cmd):
+    subprocess.check_call(cmd)
+
+
+def mount_tmpfs(path):
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    run(['mount', '-t', 'tmpfs', 'tmpfs', path])
+
+
+def wait_for(func, timeout, what):
+    start = time.time()
+    while not func():
+        if time.time() - start > timeout:
+            raise RuntimeError('timed out waiting for %s' % what)
+        time.sleep(0.01)
+    return time.time() - start
+
+
+def nm_running():
+    rc, out, err = nmcli.run_command(['nmcli', '-t', '-f', 'RUNNING', 'general'])
+    return rc == 0 and out.strip() == 'running'
+
+
+def con_state(name):
+    rc, out, err = nmcli.run_command(['nmcli', '-t', '-f', 'GENERAL.STATE', 'con', 'show', name])
+    return rc == 0 and out.strip().split(':')[-1] or None
+
+
+def cpu_time(pid):
+    # utime + stime of a process, in seconds
+    fields = open('/proc/%d/stat' % pid).read().rsplit(')', 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / float(os.sysconf('SC_CLK_TCK'))
+
+
+def percentile(values, percent):
+    # nearest rank
+    if not values:
+        return None
+    values = sorted(values)
+    return values[max(int(round(percent / 100.0 * len(values))) - 1, 0)]
+
+
+def spread(values):
+    return dict(p50=percentile(values, 50), p95=percentile(values, 95), max=max(values) if values else None)
+
+
+def run_nmcli_module(args):
+    # the module's main(), with its arguments handed in the way Ansible does
+    basic._ANSIBLE_ARGS = json.dumps({'ANSIBLE_MODULE_ARGS': args})
+    stdout = sys.stdout
+    sys.stdout = StringIO()
+    try:
+        nmcli.main()
+    except SystemExit:
+        pass
+    finally:
+        out = sys.stdout.getvalue()
+        sys.stdout = stdout
+    return json.loads(out)
+
+
+def setup():
+    run(['ip', 'link', 'set', 'lo', 'up'])
+    for link in LINKS:
+        run(['ip', 'link', 'add', link, 'type', 'veth', 'peer', 'name', '%sp' % link])
+        run(['ip', 'link', 'set', '%sp' % link, 'up'])
+    for path in ('/run/dbus', '/run/NetworkManager', '/var/lib/NetworkManager', '/etc/NetworkManager'):
+        mount_tmpfs(path)
+    os.makedirs('/etc/NetworkManager/system-connections')
+    conf = '/etc/NetworkManager/NetworkManager.conf'
+    open(conf, 'w').write(NM_CONF)
+    os.environ['DBUS_SYSTEM_BUS_ADDRESS'] = BUS_ADDRESS
+    bus = subprocess.Popen(['dbus-daemon', '--system', '--nofork', '--nopidfile'])
+    wait_for(lambda: os.path.exists('/run/dbus/system_bus_socket'), 10, 'the system bus')
+    nm = subprocess.Popen(['NetworkManager', '--no-daemon', '--config=%s' % conf])
+    wait_for(nm_running, 30, 'NetworkManager')
+    # udev marks veth devices unmanaged, and it doesn't see this namespace
+    for link in LINKS:
+        run(['nmcli', 'device', 'set', link, 'managed', 'yes'])
+    return bus, nm
+
+
+def module_args(profile, backend, scratch, state='present'):
+    return dict(profile, state=state, read_backend=backend, agent_socket='',
+                cache_dir=os.path.join(scratch, 'cache'), lock_file=os.path.join(scratch, 'lock'))
+
+
+def run_round(profiles, backend, scratch, nm_pid):
+    sample = dict(module=0.0, nmcli_calls=0, dbus_calls=0)
+    cpu = cpu_time(nm_pid)
+    start = time.time()
+    try:
+        for profile in profiles:
+            result = run_nmcli_module(module_args(profile, backend, scratch))
+            if result.get('failed'):
+                sample['error'] = result.get('msg')
+                return sample
+            sample['module'] += result['timing']['total']
+            sample['nmcli_calls'] += result['nmcli_calls']
+            sample['dbus_calls'] += result['dbus_calls']
+        wait_for(lambda: con_state(profiles[0]['cname']) == 'activated', ACTIVATE_TIMEOUT, '%s to activate' % profiles[0]['cname'])
+        sample['activate'] = time.time() - start
+        sample['nm_cpu'] = cpu_time(nm_pid) - cpu
+    except RuntimeError, e:
+        sample['error'] = str(e)
+    finally:
+        for profile in reversed(profiles):
+            run_nmcli_module(module_args(profile, backend, scratch, state='absent'))
+    return sample
+
+
+def run_scenario(name, profiles, backend, scratch, nm_pid):
+    if [profile for profile in profiles if profile['type'] in ('team', 'team-slave')] and not find_executable('teamd'):
+        return dict(skipped='teamd is not installed')
+    samples = []
+    for i in range(rounds):
+        sample = run_round(profiles, backend, scratch, nm_pid)
+        if 'error' in sample:
+            return dict(error=sample['error'], samples=samples)
+        samples.append(sample)
+    return dict(samples=samples,
+                activate=spread([sample['activate'] for sample in samples]),
+                module=spread([sample['module'] for sample in samples]),
+                nm_cpu=spread([sample['nm_cpu'] for sample in samples]),
+                nmcli_calls=percentile([sample['nmcli_calls'] for sample in samples], 50),
+                dbus_calls=percentile([sample['dbus_calls'] for sample in samples], 50))
+
+
+def main():
+    scratch = tempfile.mkdtemp()
+    bus, nm = setup()
+    try:
+        report = dict(nm_version=nmcli.run_command(['nmcli', '-t', '-f', 'VERSION', 'general'])[1].strip(),
+                      kernel=os.uname()[2],
+                      rounds=rounds,
+                      date=time.strftime('%Y-%m-%dT%H:%M:%S'),
+                      backends={})
+        print "NetworkManager %s, %d rounds" % (report['nm_version'], rounds)
+        for backend in backends:
+            results = report['backends'][backend] = {}
+            for name, profiles in SCENARIOS:
+                result = results[name] = run_scenario(name, profiles, backend, scratch, nm.pid)
+                if 'skipped' in result:
+                    print "    %-6s %-20s skipped: %s" % (backend, name, result['skipped'])
+                elif 'error' in result:
+                    print "    %-6s %-20s failed: %s" % (backend, name, result['error'])
+                else:
+                    print "    %-6s %-20s activated p50 %8.2f ms  module p50 %8.2f ms  nmcli %3d  dbus %3d  NM cpu p50 %6.2f ms" % (
+                        backend, name, result['activate']['p50'] * 1000, result['module']['p50'] * 1000,
+                        result['nmcli_calls'], result['dbus_calls'], result['nm_cpu']['p50'] * 1000)
+        with open(report_path, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        print "report written to %s" % report_path
+    finally:
+        for process in (nm, bus):
+            process.send_signal(signal.SIGTERM)
+            process.wait()
+        shutil.rmtree(scratch, True)
+
+main()
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+#
+# Time the nmcli module's 'files' read backend over a fake root, such as one
+# populated by gen-fixtures.py: a cold parse of every profile, a warm run
+# served from the mtime cache, and existence lookups on the result.
+#
+# usage: python bench-files.py <root> [rounds]
+
+import imp
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+nmcli = imp.load_source('nmcli', os.path.join(os.path.dirname(__file__), '..', 'library', 'nmcli.py'))
+
+root = sys.argv[1]
+rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+cache_dir = tempfile.mkdtemp()
+
+
+def best(func):
+    times = []
+    for i in range(rounds):
+        start = time.time()
+        result = func()
+        times.append(time.time() - start)
+    return min(times), result
+
+
+def cold():
+    shutil.rmtree(cache_dir, True)
+    return nmcli.ConnectionFileReader(root, cache_dir).connections()
+
+
+def warm():
+    return nmcli.ConnectionFileReader(root, cache_dir).connections()
+
+try:
+    cold_time, connections = best(cold)
+    warm()
+    warm_time, connections = best(warm)
+    index = dict((con.id, con) for con in connections)
+    names = [con.id for con in connections]
+    lookup_time, found = best(lambda: [name in index for name in names])
+
+    print "profiles: %d, best of %d rounds" % (len(connections), rounds)
+    print "    cold parse    %8.2f ms" % (cold_time * 1000)
+    print "    warm cache    %8.2f ms" % (warm_time * 1000)
+    print "    %d lookups %8.2f ms" % (len(names), lookup_time * 1000)
+finally:
+    shutil.rmtree(cache_dir, True)
@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+#
+# Compare the nmcli module's read backends on this host: listing every
+# connection profile, then listing them and decoding every profile's
+# settings, with a fresh client each round.  The 'dbus' backend is skipped
+# where python-dbus isn't installed.
+#
+# usage: python bench-read.py [rounds] [backend ...]
+
+import imp
+import os
+import sys
+import time
+
+nmcli = imp.load_source('nmcli', os.path.join(os.path.dirname(__file__), '..', 'library', 'nmcli.py'))
+
+rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+backends = sys.argv[2:] or ['dbus', 'nmcli']
+if not nmcli.HAS_DBUS and 'dbus' in backends:
+    print "python-dbus is not installed, skipping the dbus backend"
+    backends.remove('dbus')
+
+
+def best(func):
+    times = []
+    for i in range(rounds):
+        start = time.time()
+        result = func()
+        times.append(time.time() - start)
+    return min(times), result
+
+
+def listing(backend):
+    return nmcli.NmcliClient(read_backend=backend).list_connection_info()
+
+
+def settings(backend):
+    connections = listing(backend)
+    return [con.settings for con in connections]
+
+print "best of %d rounds" % rounds
+for backend in backends:
+    list_time, connections = best(lambda: listing(backend))
+    settings_time, decoded = best(lambda: settings(backend))
+    print "    %-6s %5d profiles  list %8.2f ms  list+settings %8.2f ms" % (backend, len(connections), list_time * 1000, settings_time * 1000)
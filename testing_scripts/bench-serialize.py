@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+#
+# Microbenchmark for turning connection settings into something printable.
+# Compares the old string building dict_to_string()/connection_to_string()
+# with the single pass dbus -> native conversion used by the nmcli module,
+# on synthetic configurations shaped like NetworkManager's GetSettings() reply.
+#
+# usage: python bench-serialize.py [profiles] [rounds]
+
+import imp
+import json
+import os
+import sys
+import timeit
+import uuid
+import dbus
+
+nmcli = imp.load_source('nmcli', os.path.join(os.path.dirname(__file__), '..', 'library', 'nmcli.py'))
+
+profiles = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+
+def make_config(n):
+    s_con = dbus.Dictionary({
+        'id': dbus.String('eth-%d' % n),
+        'uuid': dbus.String(str(uuid.uuid4())),
+        'type': dbus.String('802-3-ethernet'),
+        'interface-name': dbus.String('eth%d' % n),
+        'autoconnect': dbus.Boolean(True),
+        'timestamp': dbus.UInt64(1440000000 + n)}, signature='sv')
+    s_wired = dbus.Dictionary({
+        'mac-address': dbus.Array([dbus.Byte(b) for b in (0x52, 0x54, 0, n >> 8 & 0xff, n & 0xff, 1)], signature='y'),
+        'mtu': dbus.UInt32(9000),
+        's390-options': dbus.Dictionary({}, signature='ss')}, signature='sv')
+    s_ip4 = dbus.Dictionary({
+        'method': dbus.String('manual'),
+        'addresses': dbus.Array([dbus.Array([dbus.UInt32(0x0100a8c0 + (n << 24)), dbus.UInt32(24), dbus.UInt32(0xfe00a8c0)], signature='u')], signature='au'),
+        'dns': dbus.Array([dbus.UInt32(0x08080808), dbus.UInt32(0x04040808)], signature='u'),
+        'dns-search': dbus.Array([dbus.String('example.com')], signature='s')}, signature='sv')
+    s_ip6 = dbus.Dictionary({
+        'method': dbus.String('auto'),
+        'addresses': dbus.Array([], signature='(ayuay)'),
+        'dns': dbus.Array([], signature='ay')}, signature='sv')
+    return dbus.Dictionary({'connection': s_con, '802-3-ethernet': s_wired, 'ipv4': s_ip4, 'ipv6': s_ip6}, signature='sa{sv}')
+
+
+# the serializer the module used to run for every profile on every enumeration
+def dict_to_string(d):
+    dstr = ""
+    for key in d:
+        val = d[key]
+        str_val = ""
+        add_string = True
+        if type(val) == type(dbus.Array([])):
+            for elt in val:
+                if type(elt) == type(dbus.Byte(1)):
+                    str_val += "%s " % int(elt)
+                elif type(elt) == type(dbus.String("")):
+                    str_val += "%s" % elt
+        elif type(val) == type(dbus.Dictionary({})):
+            dstr += dict_to_string(val)
+            add_string = False
+        else:
+            str_val = val
+        if add_string:
+            dstr += "%s: %s\n" % (key, str_val)
+    return dstr
+
+
+def connection_to_string(config):
+    return [dict_to_string(config[setting_name]) for setting_name in config]
+
+
+configs = [make_config(n) for n in range(profiles)]
+
+
+def old():
+    for config in configs:
+        connection_to_string(config)
+
+
+def new():
+    for config in configs:
+        json.dumps(nmcli.native_settings(config))
+
+
+print "profiles: %d, best of %d rounds" % (profiles, rounds)
+for name, func in (('dict_to_string', old), ('native_settings+json', new)):
+    best = min(timeit.repeat(func, number=1, repeat=rounds))
+    print "    %-22s %8.2f ms  %6.2f us/profile" % (name, best * 1000, best * 1000000 / profiles)
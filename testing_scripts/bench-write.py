@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+#
+# Compare the nmcli module's write methods against this host's
+# NetworkManager: 'mod' ('nmcli con add' and 'nmcli con mod' with the
+# properties as arguments) and 'edit' (an 'nmcli con edit' session fed on
+# stdin).  For each method it creates that many dummy profiles through the
+# module's main(), modifies several properties on each, and deletes them
+# again, reporting the wall time and the nmcli processes of each phase.
+# The profiles autoconnect, as new ones do by default, and each one is
+# checked to exist once created; a save left unconfirmed fails the run.
+# It writes profiles named nmcli-bench-write-<n>, so run it on a test host.
+# Needs Ansible 2.1 or later and NetworkManager 1.8 or later (dummy).
+#
+# usage: python bench-write.py [profiles] [method ...]
+
+import imp
+import json
+import os
+import sys
+import time
+from StringIO import StringIO
+
+from ansible.module_utils import basic
+
+nmcli = imp.load_source('nmcli', os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'library', 'nmcli.py'))
+
+profiles = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+methods = sys.argv[2:] or ['mod', 'edit']
+
+
+def run_nmcli_module(args):
+    # the module's main(), with its arguments handed in the way Ansible does
+    basic._ANSIBLE_ARGS = json.dumps({'ANSIBLE_MODULE_ARGS': args})
+    stdout = sys.stdout
+    sys.stdout = StringIO()
+    try:
+        nmcli.main()
+    except SystemExit:
+        pass
+    finally:
+        out = sys.stdout.getvalue()
+        sys.stdout = stdout
+    return json.loads(out)
+
+
+def profile(n, method, **params):
+    return dict(params, cname='nmcli-bench-write-%d' % n, ifname='nbw%d' % n, type='dummy',
+                write_method=method, agent_socket='')
+
+
+def missing_profiles():
+    # the profiles the create phase should have left behind but didn't
+    rc, out, err = nmcli.run_command(['nmcli', '-t', '-f', 'NAME', 'con', 'show'])
+    names = set(out.splitlines())
+    return ['nmcli-bench-write-%d' % n for n in range(profiles) if 'nmcli-bench-write-%d' % n not in names]
+
+
+def phase(method, **params):
+    # every profile through the module, returning the time and the nmcli calls
+    start = time.time()
+    calls = 0
+    for n in range(profiles):
+        result = run_nmcli_module(profile(n, method, **params))
+        if result.get('failed'):
+            sys.exit('%s: %s' % (result.get('cname'), result.get('msg')))
+        calls += result.get('nmcli_calls', 0)
+    return time.time() - start, calls
+
+print "%d profiles" % profiles
+for method in methods:
+    try:
+        create = phase(method, state='present', ip4='192.0.2.1/24', dns4='192.0.2.53', route_metric4=100)
+        missing = missing_profiles()
+        if missing:
+            sys.exit('%s: not saved: %s' % (method, ', '.join(missing)))
+        modify = phase(method, state='present', ip4='198.51.100.1/24', gw4='198.51.100.254', dns4='198.51.100.53', route_metric4=200)
+    finally:
+        phase(method, state='absent')
+    for name, (seconds, calls) in (('create', create), ('modify', modify)):
+        print "    %-4s %-6s %8.2f ms  %6.2f ms/profile  %4d nmcli calls" % (method, name, seconds * 1000, seconds * 1000 / profiles, calls)
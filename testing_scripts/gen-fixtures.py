@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+#
+# Populate a fake root with thousands of connection profiles, for exercising
+# and benchmarking the nmcli module's 'files' read backend.  Three in four
+# profiles are keyfiles, the rest ifcfg files, spread over the connection
+# types the module manages.  The hand written profiles in fixtures/root show
+# what a single one of each looks like.
+#
+# usage: python gen-fixtures.py <root> [profiles]
+
+import os
+import sys
+import uuid
+
+root = sys.argv[1]
+profiles = int(sys.argv[2]) if len(sys.argv) > 2 else 4000
+
+keyfile_dir = os.path.join(root, 'etc/NetworkManager/system-connections')
+ifcfg_dir = os.path.join(root, 'etc/sysconfig/network-scripts')
+for directory in (keyfile_dir, ifcfg_dir):
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+KEYFILE = """[connection]
+id=%(name)s
+uuid=%(uuid)s
+type=%(type)s
+interface-name=%(ifname)s
+%(master)s
+[ipv4]
+method=manual
+address1=10.%(a)d.%(b)d.%(c)d/24,10.%(a)d.%(b)d.254
+dns=10.0.0.1;10.0.0.2;
+
+[ipv6]
+method=ignore
+"""
+
+IFCFG = """TYPE=%(type)s
+NAME=%(name)s
+UUID=%(uuid)s
+DEVICE=%(ifname)s
+ONBOOT=yes
+BOOTPROTO=none
+IPADDR=10.%(a)d.%(b)d.%(c)d
+PREFIX=24
+GATEWAY=10.%(a)d.%(b)d.254
+DNS1=10.0.0.1
+%(master)s"""
+
+types = ['ethernet', 'bond', 'team', 'ethernet', 'bridge']
+for n in range(profiles):
+    values = dict(name='con-%05d' % n, uuid=str(uuid.UUID(int=n + 1)), ifname='eth%d' % n,
+                  a=n >> 16 & 0xff, b=n >> 8 & 0xff, c=n & 0xff or 1, type=types[n % len(types)], master='')
+    if n % 4:
+        if n % 7 == 0:
+            values['master'] = 'master=con-%05d\nslave-type=bond\n' % (n - n % 5 + 1)
+        f = open(os.path.join(keyfile_dir, '%s.nmconnection' % values['name']), 'w')
+        f.write(KEYFILE % values)
+    else:
+        values['type'] = values['type'].capitalize()
+        if n % 8 == 0:
+            values['master'] = 'MASTER=con-%05d\nSLAVE=yes\n' % (n + 1)
+        f = open(os.path.join(ifcfg_dir, 'ifcfg-%s' % values['name']), 'w')
+        f.write(IFCFG % values)
+    f.close()
+
+print "wrote %d profiles below %s" % (profiles, root)